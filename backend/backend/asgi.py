@@ -19,6 +19,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 # is populated before importing code that may import ORM models.
 django_asgi_app = get_asgi_application()
 
+from chat.lifespan import LifespanApp
 from chat.routing import websocket_urlpatterns
 
 application = ProtocolTypeRouter({
@@ -28,4 +29,5 @@ application = ProtocolTypeRouter({
             websocket_urlpatterns
         )
     ),
+    "lifespan": LifespanApp(),
 })
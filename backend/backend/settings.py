@@ -19,12 +19,88 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # DeepSeek API Key
 DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY', 'sk-4931733156ef421ab94c74a5afedf9c1')
 
+# Model routes for replies (see chat/model_router.py). Prices are USD per
+# million tokens and only feed the cost metrics.
+MODEL_ROUTES = {
+    'fast': {
+        'model': os.getenv('MODEL_FAST', 'deepseek-chat'),
+        'max_tokens': 500,
+        'temperature': 0.8,
+        'input_price': 0.28,
+        'output_price': 0.42,
+    },
+    'large': {
+        'model': os.getenv('MODEL_LARGE', 'deepseek-chat'),
+        'max_tokens': 800,
+        'temperature': 0.8,
+        'input_price': 0.28,
+        'output_price': 0.42,
+    },
+}
+MODEL_ROUTE_DEFAULT = 'fast'
+MODEL_ROUTE_PREMIUM = 'large'  # Subscribers
+MODEL_ROUTE_COMPLEX = 'large'  # Long conversations and demanding messages
+MODEL_ROUTE_LONG_TURNS = int(os.getenv('MODEL_ROUTE_LONG_TURNS', '100'))
+MODEL_ROUTE_COMPLEXITY = float(os.getenv('MODEL_ROUTE_COMPLEXITY', '0.5'))
+
+# Characters open new conversations with a line of their own, served from a
+# per-character pool that is refilled in the background (see chat/openers.py)
+OPENER_PREFETCH = os.getenv('OPENER_PREFETCH', 'False').lower() == 'true'
+OPENER_POOL_SIZE = int(os.getenv('OPENER_POOL_SIZE', '3'))
+OPENER_MAX_AGE_SECONDS = int(os.getenv('OPENER_MAX_AGE_SECONDS', '3600'))
+
 # Stripe settings
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
 STRIPE_PRICE_ID = os.getenv('STRIPE_PRICE_ID', '')
 
+# Message retention: messages older than this are moved into compressed
+# per-conversation archives by `manage.py archive_messages`
+MESSAGE_RETENTION_DAYS = int(os.getenv('MESSAGE_RETENTION_DAYS', '30'))
+MESSAGE_ARCHIVE_BATCH_SIZE = int(os.getenv('MESSAGE_ARCHIVE_BATCH_SIZE', '500'))
+# Newest messages sent to the client when a chat opens; older ones are paged
+# in on request
+HISTORY_WINDOW = int(os.getenv('HISTORY_WINDOW', '50'))
+# Newest messages of a conversation kept in the prompt context (0: all of them)
+CONTEXT_MESSAGES = int(os.getenv('CONTEXT_MESSAGES', '200'))
+
+# Account erasure deletes messages in batches of this size, one short
+# transaction each (see chat/erasure.py)
+ERASURE_BATCH_SIZE = int(os.getenv('ERASURE_BATCH_SIZE', '1000'))
+
+# Processing stages around reply generation (see chat/pipeline.py)
+CHAT_PIPELINE = [
+    'chat.moderation.ModerationStage',
+]
+
+# Local moderation: comma-separated term lists matched on whole words
+MODERATION_BLOCKED_TERMS = [t for t in os.getenv('MODERATION_BLOCKED_TERMS', '').split(',') if t.strip()]
+MODERATION_REDACTED_TERMS = [t for t in os.getenv('MODERATION_REDACTED_TERMS', '').split(',') if t.strip()]
+MODERATION_PATTERNS = []  # Regexes that reject a message
+MODERATION_CLASSIFIER = os.getenv('MODERATION_CLASSIFIER', '')  # Dotted path to a text -> score callable
+MODERATION_CLASSIFIER_THRESHOLD = float(os.getenv('MODERATION_CLASSIFIER_THRESHOLD', '0.8'))
+MODERATION_CACHE_SIZE = 10000
+
+# Usage counters are buffered in memory and written to the rollup tables
+# at most this often
+USAGE_FLUSH_SECONDS = int(os.getenv('USAGE_FLUSH_SECONDS', '60'))
+
+# Preload API clients, URLconf and templates before the worker takes traffic
+WARMUP_ON_STARTUP = os.getenv('WARMUP_ON_STARTUP', 'True').lower() == 'true'
+
+# On shutdown, how long in-flight replies get to finish before sockets are
+# closed, and the range clients are told to wait before reconnecting
+SHUTDOWN_DRAIN_SECONDS = int(os.getenv('SHUTDOWN_DRAIN_SECONDS', '20'))
+RECONNECT_MIN_MS = int(os.getenv('RECONNECT_MIN_MS', '500'))
+RECONNECT_MAX_MS = int(os.getenv('RECONNECT_MAX_MS', '5000'))
+
+# Sockets with no chat activity for SOCKET_IDLE_SECONDS drop their in-memory
+# context (reloaded on the next message); sockets that send nothing at all,
+# heartbeats included, for SOCKET_TIMEOUT_SECONDS are closed
+SOCKET_IDLE_SECONDS = int(os.getenv('SOCKET_IDLE_SECONDS', '300'))
+SOCKET_TIMEOUT_SECONDS = int(os.getenv('SOCKET_TIMEOUT_SECONDS', '120'))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/6.0/howto/deployment/checklist/
@@ -41,7 +117,6 @@ ALLOWED_HOSTS = ['charmifyai.com', 'www.charmifyai.com', '98.91.73.232', 'localh
 # Application definition
 
 INSTALLED_APPS = [
-    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -54,6 +129,11 @@ INSTALLED_APPS = [
     'chat',
 ]
 
+# daphne only provides the ASGI runserver; production runs under Uvicorn, so
+# don't make every worker import Twisted for it
+if DEBUG:
+    INSTALLED_APPS.insert(0, 'daphne')
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
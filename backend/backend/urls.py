@@ -4,8 +4,9 @@ from django.views.generic import TemplateView
 from django.conf import settings
 from django.conf.urls.static import static
 from chat.views import (
-    recent_chats, register, login, get_profile, update_profile, delete_account,
-    create_checkout_session, stripe_webhook, subscription_status, cancel_subscription
+    recent_chats, register, login, get_profile, update_profile, delete_account, erasure_status,
+    create_checkout_session, stripe_webhook, subscription_status, cancel_subscription,
+    connection_report, route_report
 )
 
 urlpatterns = [
@@ -16,6 +17,7 @@ urlpatterns = [
     path('api/auth/profile/', get_profile, name='get_profile'),
     path('api/auth/profile/update/', update_profile, name='update_profile'),
     path('api/auth/profile/delete/', delete_account, name='delete_account'),
+    path('api/auth/erasure/<uuid:job_id>/', erasure_status, name='erasure_status'),
     # Chat API routes
     path('api/chats/recent/', recent_chats, name='recent_chats'),
     # Stripe API routes
@@ -23,6 +25,9 @@ urlpatterns = [
     path('api/stripe/webhook/', stripe_webhook, name='stripe_webhook'),
     path('api/stripe/subscription-status/', subscription_status, name='subscription_status'),
     path('api/stripe/cancel-subscription/', cancel_subscription, name='cancel_subscription'),
+    # Ops
+    path('api/ops/connections/', connection_report, name='connection_report'),
+    path('api/ops/routes/', route_report, name='route_report'),
 ]
 
 # Serve static files in development
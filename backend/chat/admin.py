@@ -1,6 +1,39 @@
 from django.contrib import admin
-from .models import Conversation, Message, Subscription
+from .models import Conversation, ErasureJob, Message, MessageArchive, Room, Subscription, UsageRollup
 
 admin.site.register(Conversation)
 admin.site.register(Message)
+admin.site.register(MessageArchive)
+admin.site.register(Room)
 admin.site.register(Subscription)
+
+
+@admin.register(UsageRollup)
+class UsageRollupAdmin(admin.ModelAdmin):
+    """Usage dashboard. Reads only the rollup table, never Message/Conversation."""
+    list_display = (
+        'bucket_start', 'period', 'character_name', 'messages', 'conversations',
+        'unique_sessions', 'active_conversations', 'tokens', 'errors',
+    )
+    list_filter = ('period', 'character_name')
+    date_hierarchy = 'bucket_start'
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ErasureJob)
+class ErasureJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'user_id', 'status', 'conversations_deleted', 'conversations_total',
+        'messages_deleted', 'messages_total', 'created_at', 'finished_at',
+    )
+    list_filter = ('status',)
+    readonly_fields = [field.name for field in ErasureJob._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
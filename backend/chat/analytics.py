@@ -0,0 +1,129 @@
+"""Incremental usage rollups.
+
+The write path calls record(), which only bumps in-memory counters. They
+are added to the hourly and daily UsageRollup rows at most every
+USAGE_FLUSH_SECONDS, in one short transaction, so the chat path never does
+extra writes per message and the admin never scans the Message table.
+Each flush also prunes the UsageSession and UsageConversation rows of
+buckets that are over.
+
+record() and flush() touch the database; call them from sync code (e.g.
+inside database_sync_to_async).
+"""
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import UsageConversation, UsageRollup, UsageSession
+
+COUNTERS = ('messages', 'conversations', 'tokens', 'errors')
+
+_lock = threading.Lock()
+_counts = defaultdict(lambda: defaultdict(int))  # (period, bucket_start, character_id) -> counters
+_sessions = defaultdict(set)  # (period, bucket_start, character_id) -> session ids
+_conversations = defaultdict(set)  # (period, bucket_start, character_id) -> conversation ids
+_names = {}  # character_id -> character name
+_last_flush = time.monotonic()
+
+
+def buckets(now):
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    return (('hour', hour), ('day', hour.replace(hour=0)))
+
+
+def record(character_id, character_name='', session=None, conversation=None, **counters):
+    """Count usage for a character, e.g. record(3, 'Jess', session, conversation_id, messages=1)."""
+    global _last_flush
+
+    with _lock:
+        _names[character_id] = character_name
+        for period, bucket_start in buckets(timezone.now()):
+            key = (period, bucket_start, character_id)
+            for name, value in counters.items():
+                _counts[key][name] += value
+            if session:
+                _sessions[key].add(session)
+            if conversation:
+                _conversations[key].add(conversation)
+
+        due = time.monotonic() - _last_flush >= settings.USAGE_FLUSH_SECONDS
+        if due:
+            _last_flush = time.monotonic()
+
+    if due:
+        flush()
+
+
+def flush():
+    """Write buffered counters to the rollup tables."""
+    with _lock:
+        counts = dict(_counts)
+        sessions = dict(_sessions)
+        conversations = dict(_conversations)
+        names = dict(_names)
+        _counts.clear()
+        _sessions.clear()
+        _conversations.clear()
+
+    with transaction.atomic():
+        for key in set(counts) | set(sessions) | set(conversations):
+            period, bucket_start, character_id = key
+            rollup, _ = UsageRollup.objects.get_or_create(
+                period=period,
+                bucket_start=bucket_start,
+                character_id=character_id,
+                defaults={'character_name': names.get(character_id, '')},
+            )
+
+            updates = {
+                name: F(name) + value
+                for name, value in counts.get(key, {}).items()
+                if name in COUNTERS and value
+            }
+
+            for model, field, counter, pending in (
+                (UsageSession, 'user_session', 'unique_sessions', sessions.get(key)),
+                (UsageConversation, 'conversation_id', 'active_conversations', conversations.get(key)),
+            ):
+                new = _add_new(model, field, key, pending) if pending else 0
+                if new:
+                    updates[counter] = F(counter) + new
+
+            if updates:
+                UsageRollup.objects.filter(pk=rollup.pk).update(**updates)
+
+    prune()
+
+
+def _add_new(model, field, key, pending):
+    """Store the members of `pending` (sessions or conversations) the bucket
+    hasn't counted yet. Returns how many there were."""
+    period, bucket_start, character_id = key
+    bucket = {'period': period, 'bucket_start': bucket_start, 'character_id': character_id}
+    seen = set(model.objects.filter(**bucket, **{f'{field}__in': pending}).values_list(field, flat=True))
+    new = pending - seen
+    model.objects.bulk_create([model(**bucket, **{field: member}) for member in new])
+    return len(new)
+
+
+def prune(now=None):
+    """Delete the sessions and conversations of hour and day buckets that no
+    longer take new ones.
+
+    They are only counted in the current bucket, but the previous one is
+    kept too, for counters other processes still buffer when the hour or
+    day rolls over. Returns the number of rows deleted.
+    """
+    (_, hour), (_, day) = buckets(now or timezone.now())
+    finished = (
+        Q(period='hour', bucket_start__lt=hour - timedelta(hours=1))
+        | Q(period='day', bucket_start__lt=day - timedelta(days=1))
+    )
+    deleted = 0
+    for model in (UsageSession, UsageConversation):
+        deleted += model.objects.filter(finished).delete()[0]
+    return deleted
@@ -0,0 +1,164 @@
+import gzip
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Message, MessageArchive
+
+
+def pack_messages(rows):
+    """Serialize message rows into a gzip'd JSON blob."""
+    payload = [
+        {
+            'seq': row['seq'],
+            'sender': row['sender'],
+            'speaker': row['speaker'],
+            'content': row['content'],
+            'created_at': row['created_at'].isoformat(),
+        }
+        for row in rows
+    ]
+    return gzip.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+
+
+def unpack_messages(data):
+    """Inverse of pack_messages. Returns a list of dicts."""
+    rows = json.loads(gzip.decompress(bytes(data)).decode('utf-8'))
+    for row in rows:
+        row['created_at'] = parse_datetime(row['created_at'])
+    return rows
+
+
+def archive_conversation(conversation_id, cutoff, batch_size=None):
+    """Move a conversation's messages older than `cutoff` into archives.
+
+    Each batch becomes its own archive row and is moved in its own
+    transaction, so a long backlog never holds the database lock for long.
+    Returns the number of messages archived.
+    """
+    batch_size = batch_size or settings.MESSAGE_ARCHIVE_BATCH_SIZE
+    archived = 0
+
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Message.objects.filter(conversation_id=conversation_id, created_at__lt=cutoff)
+                .order_by('seq')
+                .values('id', 'seq', 'sender', 'speaker', 'content', 'created_at')[:batch_size]
+            )
+            if not rows:
+                break
+
+            MessageArchive.objects.create(
+                conversation_id=conversation_id,
+                data=pack_messages(rows),
+                message_count=len(rows),
+                first_seq=rows[0]['seq'],
+                last_seq=rows[-1]['seq'],
+                first_message_at=rows[0]['created_at'],
+                last_message_at=rows[-1]['created_at'],
+            )
+            Message.objects.filter(id__in=[row['id'] for row in rows]).delete()
+
+        archived += len(rows)
+        if len(rows) < batch_size:
+            break
+
+    return archived
+
+
+def archive_old_messages(days=None):
+    """Archive every message older than `days` (MESSAGE_RETENTION_DAYS by default).
+
+    Returns a (conversations, messages) tuple of what was moved.
+    """
+    if days is None:
+        days = settings.MESSAGE_RETENTION_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+
+    conversation_ids = list(
+        Message.objects.filter(created_at__lt=cutoff)
+        .order_by()
+        .values_list('conversation_id', flat=True)
+        .distinct()
+    )
+
+    total = 0
+    for conversation_id in conversation_ids:
+        total += archive_conversation(conversation_id, cutoff)
+
+    return len(conversation_ids), total
+
+
+def _history_row(row):
+    return {
+        'seq': row['seq'],
+        'sender': row['sender'],
+        'speaker': row.get('speaker', ''),
+        'content': row['content'],
+    }
+
+
+def load_history(conversation, after_seq=0):
+    """Message history of a conversation, archived messages first.
+
+    Only messages with a seq greater than `after_seq` are returned; archives
+    that hold nothing newer are never decompressed. To open a chat, use
+    load_recent() instead.
+    """
+    history = []
+    for archive in conversation.archives.filter(last_seq__gt=after_seq):
+        for row in unpack_messages(archive.data):
+            if row['seq'] > after_seq:
+                history.append(_history_row(row))
+
+    history.extend(
+        conversation.messages.filter(seq__gt=after_seq).values('seq', 'sender', 'speaker', 'content')
+    )
+    return history
+
+
+def load_recent(conversation, before_seq=None, limit=None):
+    """The newest `limit` messages (HISTORY_WINDOW by default) before
+    `before_seq`, oldest first.
+
+    Archives are only decompressed once the Message table runs out, i.e.
+    when paging back past what's still in it.
+    """
+    limit = limit or settings.HISTORY_WINDOW
+    hot = conversation.messages.all()
+    if before_seq is not None:
+        hot = hot.filter(seq__lt=before_seq)
+    history = list(hot.order_by('-seq').values('seq', 'sender', 'speaker', 'content')[:limit])
+    history.reverse()
+    if len(history) == limit:
+        return history
+
+    oldest = history[0]['seq'] if history else before_seq
+    archives = conversation.archives.order_by('-first_seq')
+    if oldest is not None:
+        archives = archives.filter(first_seq__lt=oldest)
+    for archive in archives:
+        rows = [
+            _history_row(row) for row in unpack_messages(archive.data)
+            if oldest is None or row['seq'] < oldest
+        ]
+        history[:0] = rows[-(limit - len(history)):]
+        if len(history) == limit:
+            break
+    return history
+
+
+def last_message(conversation):
+    """Most recent message of a conversation, looking into archives if the hot table is empty."""
+    message = conversation.messages.last()
+    if message:
+        return {'sender': message.sender, 'content': message.content}
+
+    archive = conversation.archives.last()
+    if archive:
+        row = unpack_messages(archive.data)[-1]
+        return {'sender': row['sender'], 'content': row['content']}
+    return None
@@ -0,0 +1,44 @@
+"""JWT helpers shared by the HTTP views and the WebSocket consumers."""
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+
+
+def get_user_from_token(request):
+    """Extract user from JWT token in Authorization header."""
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    return user_from_token(auth_header.split(' ')[1])
+
+
+def user_from_token(token):
+    """User for a JWT issued by generate_token, or None."""
+    user_id = user_id_from_token(token)
+    if user_id is None:
+        return None
+    return User.objects.filter(id=user_id).first()
+
+
+def user_id_from_token(token):
+    """User ID a valid JWT was issued for, whether or not the user still exists."""
+    import jwt
+
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
+        return payload['user_id']
+    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError, KeyError):
+        return None
+
+
+def generate_token(user):
+    """Generate JWT token for user."""
+    import jwt
+
+    payload = {
+        'user_id': user.id,
+        'email': user.email,
+        'exp': datetime.utcnow() + timedelta(days=7),
+        'iat': datetime.utcnow()
+    }
+    return jwt.encode(payload, settings.SECRET_KEY, algorithm='HS256')
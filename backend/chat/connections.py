@@ -0,0 +1,93 @@
+"""Registry of the sockets open in this process.
+
+A background sweep drops the prompt context of sockets that have gone quiet
+(it is reloaded from the database on their next message) and closes sockets
+that have stopped sending anything at all, heartbeats included. report()
+summarises what the open sockets are holding in memory.
+"""
+import asyncio
+import sys
+import time
+import weakref
+from django.conf import settings
+
+SWEEP_INTERVAL = 15  # Seconds between sweeps
+
+_consumers = weakref.WeakSet()
+_sweeper = None
+
+
+def add(consumer):
+    global _sweeper
+    _consumers.add(consumer)
+    loop = asyncio.get_running_loop()
+    if _sweeper is None or _sweeper.done() or _sweeper.get_loop() is not loop:
+        _sweeper = loop.create_task(_run_sweeper())
+
+
+def discard(consumer):
+    _consumers.discard(consumer)
+
+
+def open_consumers():
+    return list(_consumers)
+
+
+async def _run_sweeper():
+    while _consumers:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            await sweep()
+        except Exception as e:
+            print(f"Error sweeping sockets: {e}")
+
+
+async def sweep():
+    """Evict idle sockets' context and close dead sockets. Returns (evicted, closed)."""
+    now = time.monotonic()
+    evicted = closed = 0
+    for consumer in open_consumers():
+        if now - consumer.last_seen >= settings.SOCKET_TIMEOUT_SECONDS:
+            discard(consumer)
+            consumer.evict()
+            await consumer.close(code=1001)
+            closed += 1
+        elif not consumer.evicted and now - consumer.last_activity >= settings.SOCKET_IDLE_SECONDS:
+            consumer.evict()
+            evicted += 1
+
+    if evicted or closed:
+        print(f"Swept sockets: {evicted} evicted, {closed} closed, {len(_consumers)} open")
+    return evicted, closed
+
+
+def estimate_size(obj):
+    """Approximate bytes held by nested dicts/lists of plain values."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(key) + estimate_size(value) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(estimate_size(item) for item in obj)
+    return size
+
+
+def report(limit=20):
+    """Open sockets in this process and the memory their context holds, largest first."""
+    now = time.monotonic()
+    sockets = [
+        {
+            'path': consumer.scope.get('path', ''),
+            'conversation': consumer.conversation.id if consumer.conversation else None,
+            'idle_seconds': int(now - consumer.last_activity),
+            'evicted': consumer.evicted,
+            'bytes': consumer.memory_bytes(),
+        }
+        for consumer in open_consumers()
+    ]
+    sockets.sort(key=lambda socket: socket['bytes'], reverse=True)
+    return {
+        'connections': len(sockets),
+        'evicted': sum(1 for socket in sockets if socket['evicted']),
+        'bytes': sum(socket['bytes'] for socket in sockets),
+        'largest': sockets[:limit],
+    }
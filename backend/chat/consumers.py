@@ -1,36 +1,76 @@
-import json
+import functools
+import time
 import uuid
 import traceback
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.conf import settings
-from openai import AsyncOpenAI
-from .models import Conversation, Message
+from . import analytics, connections, generations, lifespan, openers, pipeline, protocol
+from .archive import load_history, load_recent
+from .auth import user_from_token
+from .models import Conversation, Room, StaleConversation, Subscription
+
+# Optimistic appends retried before falling back to an unconditional append
+SAVE_ATTEMPTS = 3
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.character_id = self.scope['url_route']['kwargs']['character_id']
-        self.messages = []
-        self.system_prompt = None
-        self.character_name = None
-        self.character_avatar = None
+        self.setup()
         self.conversation = None
         self.initialized = False
         self.session_id = None  # Will be set from init message
-
-        # Initialize DeepSeek client
-        self.client = AsyncOpenAI(
-            api_key=settings.DEEPSEEK_API_KEY,
-            base_url="https://api.deepseek.com"
-        )
+        self.wire_format = protocol.DEFAULT_FORMAT
+        self.seq = 0  # Newest message reflected in this socket's context
+        self.history_seq = 0  # Newest message the client has from the history frame
+        self.version = None  # Conversation.version that context corresponds to
+        self.premium = False  # Replies use the subscriber route
+        self.evicted = False  # Context dropped while idle; reloaded on the next message
+        self.last_seen = self.last_activity = time.monotonic()
 
         await self.accept()
-        print(f"WebSocket connected for character {self.character_id}")
+        if lifespan.is_draining():
+            # This process is shutting down; send the client to the next one
+            await self.send_reconnect(1013)
+            return
+        connections.add(self)
+        print(f"WebSocket connected for {self.label}")
+
+    def setup(self):
+        """State specific to this kind of chat, set when the socket connects."""
+        self.character_id = self.scope['url_route']['kwargs']['character_id']
+        self.label = f"character {self.character_id}"
+        self.messages = []
+        self.system_prompt = None
+        self.character_name = None
+        self.character_avatar = None
 
     async def disconnect(self, close_code):
+        connections.discard(self)
+        if self.conversation:
+            await self.channel_layer.group_discard(
+                generations.group_name(self.conversation.id), self.channel_name
+            )
+        self.evict()
         print(f"WebSocket disconnected: {close_code}")
 
+    async def websocket_receive(self, message):
+        self.last_seen = time.monotonic()
+        await super().websocket_receive(message)
+
+    async def send_event(self, payload):
+        """Send a frame to the client in its negotiated wire format."""
+        text_data, bytes_data = protocol.encode(payload, self.wire_format)
+        await self.send(text_data=text_data, bytes_data=bytes_data)
+
+    async def send_reconnect(self, code):
+        """Tell the client when to reconnect, then close with `code`."""
+        await self.send_event({
+            'type': 'reconnect',
+            'retryAfterMs': lifespan.retry_after_ms(),
+        })
+        await self.close(code=code)
+
     @database_sync_to_async
     def get_or_create_conversation(self):
         conversation, created = Conversation.objects.get_or_create(
@@ -41,36 +81,300 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'character_avatar': self.character_avatar or '',
             }
         )
+        if created:
+            analytics.record(
+                conversation.character_id, conversation.character_name, self.session_id, conversation.id,
+                conversations=1,
+            )
         print(f"Conversation {'created' if created else 'loaded'}: {conversation.id}")
         return conversation
 
     @database_sync_to_async
-    def save_message(self, sender, content):
-        if self.conversation:
-            msg = Message.objects.create(
-                conversation=self.conversation,
-                sender=sender,
-                content=content
-            )
-            # Update conversation timestamp
-            self.conversation.save()
-            print(f"Message saved: {sender} - {content[:50]}...")
-            return msg
-        return None
+    def is_subscriber(self, token):
+        """Whether the user the client's token belongs to has an active subscription."""
+        user = user_from_token(token) if token else None
+        if not user:
+            return False
+        subscription = Subscription.objects.filter(user=user).first()
+        return bool(subscription and subscription.is_active)
+
+    @database_sync_to_async
+    def save_message(self, sender, content, speaker=''):
+        """Append a message, provided this socket has seen the whole conversation.
+
+        Returns (msg, missed). If another socket changed the conversation
+        since our last read, the append is retried after fetching only the
+        messages we missed, which are returned so the caller can catch up.
+        """
+        missed = []
+        seen = self.seq
+        for attempt in range(SAVE_ATTEMPTS):
+            expected = self.version if attempt < SAVE_ATTEMPTS - 1 else None
+            try:
+                msg = self.conversation.append_message(sender, content, speaker, expected_version=expected)
+                break
+            except StaleConversation:
+                if attempt == SAVE_ATTEMPTS - 1:
+                    # Even the unconditional append failed: the conversation is gone
+                    raise
+                self.version = Conversation.objects.values_list('version', flat=True).get(pk=self.conversation.pk)
+                newer = load_history(self.conversation, after_seq=seen)
+                if newer:
+                    missed.extend(newer)
+                    seen = newer[-1]['seq']
+
+        self.version = self.conversation.version
+        analytics.record(
+            self.conversation.character_id, self.conversation.character_name, self.session_id,
+            self.conversation.id, messages=1,
+        )
+        print(f"Message saved: {sender} #{msg.seq} - {content[:50]}...")
+        return msg, missed
+
+    @database_sync_to_async
+    def load_missed(self):
+        """Current conversation version and the messages after self.seq."""
+        version = Conversation.objects.values_list('version', flat=True).get(pk=self.conversation.pk)
+        return version, load_history(self.conversation, after_seq=self.seq)
 
     @database_sync_to_async
     def load_messages(self):
-        if self.conversation:
-            messages = list(self.conversation.messages.all().values('sender', 'content'))
-            print(f"Loaded {len(messages)} messages from history")
-            return messages
-        return []
+        """Current conversation version and its newest messages.
+
+        Enough are loaded for both the prompt context (CONTEXT_MESSAGES, or
+        the whole conversation if that's 0) and the client's first page of
+        history (HISTORY_WINDOW).
+        """
+        version = Conversation.objects.values_list('version', flat=True).get(pk=self.conversation.pk)
+        if settings.CONTEXT_MESSAGES:
+            limit = max(settings.CONTEXT_MESSAGES, settings.HISTORY_WINDOW)
+            messages = load_recent(self.conversation, limit=limit)
+        else:
+            messages = load_history(self.conversation)
+        print(f"Loaded {len(messages)} messages from history")
+        return version, messages
+
+    def reset_context(self):
+        self.messages = [
+            {"role": "system", "content": self.system_prompt}
+        ]
+
+    def add_to_context(self, msg):
+        self.messages.append(generations.prompt_message(msg))
+
+    def set_context(self, messages):
+        """Replace the context with the last CONTEXT_MESSAGES of `messages`, the newest stored ones."""
+        if settings.CONTEXT_MESSAGES:
+            messages = messages[-settings.CONTEXT_MESSAGES:]
+        self.reset_context()
+        for msg in messages:
+            self.add_to_context(msg)
+        self.seq = messages[-1]['seq'] if messages else 0
+
+    def evict(self):
+        """Drop the in-memory context; hydrate() reloads it when it's needed again."""
+        self.reset_context()
+        self.evicted = True
+
+    async def hydrate(self):
+        """Rebuild the context dropped by evict() from the database."""
+        self.evicted = False
+        self.version, messages = await self.load_messages()
+        self.set_context(messages)
+
+    def memory_bytes(self):
+        return connections.estimate_size(self.messages)
+
+    async def remember(self, msg, version=None):
+        """Bring this socket's context up to date with a stored message.
+
+        Messages already seen are ignored. If `msg` isn't the next one, the
+        gap is filled from the database instead.
+        """
+        if self.evicted:
+            return
+        if msg['seq'] <= self.seq:
+            return
+        if msg['seq'] != self.seq + 1:
+            await self.catch_up()
+            return
+
+        self.add_to_context(msg)
+        self.seq = msg['seq']
+        if version is not None and self.version is not None and version == self.version + 1:
+            self.version = version
+
+    async def catch_up(self, missed=None):
+        """Add messages this socket missed to its context, fetching them if not given."""
+        if missed is None:
+            self.version, missed = await self.load_missed()
+        for msg in missed:
+            if msg['seq'] > self.seq:
+                self.add_to_context(msg)
+                self.seq = msg['seq']
+
+    async def send_history(self, messages, last_seq):
+        """Send the client what it hasn't seen: the newest HISTORY_WINDOW of
+        `messages`, or on a reconnect just the messages after `last_seq`."""
+        if last_seq:
+            if messages and messages[0]['seq'] > last_seq + 1:
+                # Gone for longer than the loaded messages cover
+                messages = await database_sync_to_async(load_history)(self.conversation, last_seq)
+            else:
+                messages = [msg for msg in messages if msg['seq'] > last_seq]
+        else:
+            messages = messages[-settings.HISTORY_WINDOW:]
+
+        # Broadcasts for these can still arrive if they were saved while
+        # joining; chat_message and chat_user_message skip them
+        self.history_seq = max(messages[-1]['seq'] if messages else 0, int(last_seq or 0))
+        if messages:
+            await self.send_event({
+                'type': 'history',
+                'messages': messages,
+                'since': last_seq or 0,
+                'more': not last_seq and messages[0]['seq'] > 1,
+            })
+
+    async def send_older(self, before_seq):
+        """Send the page of messages before `before_seq`, for a client scrolling back."""
+        if not self.initialized or not self.conversation:
+            await self.send_event({
+                'type': 'error',
+                'message': 'Chat not initialized. Please refresh the page.'
+            })
+            return
+        messages = await database_sync_to_async(load_recent)(self.conversation, int(before_seq))
+        await self.send_event({
+            'type': 'older',
+            'messages': messages,
+            'more': bool(messages) and messages[0]['seq'] > 1,
+        })
+
+    async def negotiate_format(self, data):
+        """Switch to the wire format asked for in `init`. Returns False if it isn't supported."""
+        wire_format = data.get('format', protocol.DEFAULT_FORMAT)
+        if wire_format not in protocol.FORMATS:
+            await self.send_event({
+                'type': 'error',
+                'message': f'Unsupported format: {wire_format}'
+            })
+            return False
+        self.wire_format = wire_format
+        return True
+
+    async def accept_message(self, content):
+        """Moderate a user message before anything is stored or sent to the API.
+
+        Returns the text to store, or None if the message can't be taken
+        (the client has been told why).
+        """
+        if not self.initialized or not self.conversation:
+            await self.send_event({
+                'type': 'error',
+                'message': 'Chat not initialized. Please refresh the page.'
+            })
+            return None
+
+        self.last_activity = time.monotonic()
+        if self.evicted:
+            await self.hydrate()
+
+        verdict = pipeline.process_input(content)
+        if verdict.rejected:
+            await self.send_event({
+                'type': 'error',
+                'message': verdict.reason
+            })
+            return None
+        return verdict.text
+
+    async def post_message(self, content, speaker=''):
+        """Save a user message, acknowledge it and show it on the conversation's other sockets."""
+        # Catch up first if another socket on this conversation got there before us
+        user_message, missed = await self.save_message('user', content, speaker)
+        await self.catch_up(missed)
+        await self.remember({
+            'seq': user_message.seq,
+            'sender': 'user',
+            'speaker': speaker,
+            'content': content,
+        })
+        await self.send_event({
+            'type': 'ack',
+            'seq': user_message.seq
+        })
+
+        await self.channel_layer.group_send(
+            generations.group_name(self.conversation.id),
+            {
+                'type': 'chat.user_message',
+                'content': content,
+                'seq': user_message.seq,
+                'version': self.version,
+                'speaker': speaker,
+                'origin': self.channel_name,
+            }
+        )
+        return user_message
+
+    async def chat_message(self, event):
+        """A reply was saved for this conversation (possibly requested by another socket)."""
+        await self.remember({
+            'seq': event['seq'],
+            'sender': 'character',
+            'speaker': event.get('speaker', ''),
+            'content': event['content'],
+        }, event.get('version'))
+        if event['seq'] <= self.history_seq:
+            return
+
+        payload = {
+            'type': 'message',
+            'content': event['content'],
+            'seq': event['seq'],
+        }
+        if event.get('speaker'):
+            payload['speaker'] = event['speaker']
+        await self.send_event(payload)
+
+    async def chat_user_message(self, event):
+        """A user message was saved, by this socket or another one on the conversation."""
+        await self.remember({
+            'seq': event['seq'],
+            'sender': 'user',
+            'speaker': event.get('speaker', ''),
+            'content': event['content'],
+        }, event.get('version'))
+
+        if event['origin'] != self.channel_name and event['seq'] > self.history_seq:
+            payload = {
+                'type': 'user_message',
+                'content': event['content'],
+                'seq': event['seq'],
+            }
+            if event.get('speaker'):
+                payload['speaker'] = event['speaker']
+            await self.send_event(payload)
+
+    async def chat_typing(self, event):
+        payload = {'type': 'typing'}
+        if event.get('speaker'):
+            payload['speaker'] = event['speaker']
+        await self.send_event(payload)
 
-    async def receive(self, text_data):
+    async def chat_error(self, event):
+        await self.send_event({
+            'type': 'error',
+            'message': event['message'],
+        })
+
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
+            data = protocol.decode(text_data, bytes_data, self.wire_format)
             message_type = data.get('type')
-            print(f"Received message type: {message_type}")
+            if message_type != 'ping':
+                print(f"Received message type: {message_type}")
 
             if message_type == 'init':
                 # Get session ID from client
@@ -78,6 +382,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 if not self.session_id:
                     self.session_id = str(uuid.uuid4())
 
+                # Optional compact wire format for subsequent frames
+                if not await self.negotiate_format(data):
+                    return
+
                 # Store character info
                 character = data.get('character', {})
                 self.system_prompt = character.get('systemPrompt', '')
@@ -86,98 +394,282 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
                 print(f"Initializing chat with {self.character_name}, session {self.session_id[:8]}...")
 
+                # Subscribers' replies are routed to the premium model
+                self.premium = await self.is_subscriber(data.get('token'))
+
                 # Get or create conversation
                 self.conversation = await self.get_or_create_conversation()
 
-                # Load existing messages from database
-                saved_messages = await self.load_messages()
+                # Replies for this conversation are broadcast to all of its sockets
+                await self.channel_layer.group_add(
+                    generations.group_name(self.conversation.id), self.channel_name
+                )
 
-                # Initialize conversation with system prompt
-                self.messages = [
-                    {"role": "system", "content": self.system_prompt}
-                ]
-
-                # Add saved messages to context
-                for msg in saved_messages:
-                    role = "user" if msg['sender'] == 'user' else "assistant"
-                    self.messages.append({"role": role, "content": msg['content']})
+                # Load recent messages from database and start the context
+                # from them, after the system prompt
+                self.version, saved_messages = await self.load_messages()
+                self.set_context(saved_messages)
+                self.evicted = False
+                self.last_activity = time.monotonic()
 
                 self.initialized = True
+                is_new = not saved_messages
 
-                # Send saved messages to client
-                if saved_messages:
-                    await self.send(text_data=json.dumps({
-                        'type': 'history',
-                        'messages': saved_messages
-                    }))
+                # Send saved messages to client; a reconnecting client only
+                # gets what it hasn't seen yet
+                await self.send_history(saved_messages, data.get('lastSeq'))
 
                 # Send ready confirmation
-                await self.send(text_data=json.dumps({
+                await self.send_event({
                     'type': 'ready'
-                }))
+                })
+
+                # A reply (or opener) started before a reconnect arrives
+                # through the group
+                if generations.is_running(self.conversation.id) or openers.is_opening(self.conversation.id):
+                    await self.send_event({
+                        'type': 'typing'
+                    })
+
+                # The character speaks first in a new conversation
+                if is_new and settings.OPENER_PREFETCH:
+                    openers.open_conversation(self.conversation, self.system_prompt)
 
             elif message_type == 'message':
                 content = data.get('content', '')
                 print(f"User message: {content[:50]}...")
 
-                if not self.initialized or not self.conversation:
-                    await self.send(text_data=json.dumps({
-                        'type': 'error',
-                        'message': 'Chat not initialized. Please refresh the page.'
-                    }))
+                content = await self.accept_message(content)
+                if content is None:
                     return
 
-                # Add user message to history
-                self.messages.append({"role": "user", "content": content})
-
-                # Save user message to database
-                await self.save_message('user', content)
+                # Save user message to database; other tabs on the
+                # conversation show it too
+                await self.post_message(content)
 
                 # Send typing indicator
-                await self.send(text_data=json.dumps({
+                await self.send_event({
                     'type': 'typing'
-                }))
-
-                try:
-                    print("Calling DeepSeek API...")
-                    # Call DeepSeek API
-                    response = await self.client.chat.completions.create(
-                        model="deepseek-chat",
-                        messages=self.messages,
-                        max_tokens=500,
-                        temperature=0.8,
-                    )
+                })
 
-                    # Get AI response
-                    ai_message = response.choices[0].message.content
-                    print(f"AI response: {ai_message[:50]}...")
+                # Generate the reply in the background; it is pushed to this
+                # conversation's sockets through chat_message when it's saved
+                generations.start(self.conversation, self.messages, self.seq, premium=self.premium)
 
-                    # Add AI response to history
-                    self.messages.append({"role": "assistant", "content": ai_message})
+            elif message_type == 'older':
+                # Client scrolled back past the messages it has
+                await self.send_older(data.get('beforeSeq'))
 
-                    # Save AI response to database
-                    await self.save_message('character', ai_message)
+            elif message_type == 'ping':
+                # Heartbeat; receiving it is enough to keep the socket open
+                await self.send_event({
+                    'type': 'pong'
+                })
 
-                    # Send response to client
-                    await self.send(text_data=json.dumps({
-                        'type': 'message',
-                        'content': ai_message
-                    }))
+        except Exception as e:
+            print(f"Error processing message: {e}")
+            traceback.print_exc()
+            await self.send_event({
+                'type': 'error',
+                'message': str(e)
+            })
+
+
+def pick_character(characters, history):
+    """Character that replies next: the one addressed by name in the newest
+    user message, otherwise the one after the character that spoke last."""
+    for msg in reversed(history):
+        if msg['sender'] == 'user':
+            lowered = msg['content'].lower()
+            for character in characters:
+                if character.get('name', '').lower() in lowered:
+                    return character
+            break
+
+    names = [character.get('name') for character in characters]
+    for msg in reversed(history):
+        if msg['sender'] == 'character' and msg['speaker'] in names:
+            return characters[(names.index(msg['speaker']) + 1) % len(characters)]
+    return characters[0]
+
+
+def room_prompt(characters, character, history):
+    others = ', '.join(c['name'] for c in characters if c is not character)
+    system_prompt = character.get('systemPrompt', '')
+    system_prompt += (
+        f"\n\nYou are in a group chat. Other characters present: {others or 'none'}. "
+        f"Messages from others are prefixed with their name. Reply only as {character['name']}."
+    )
+    messages = [{"role": "system", "content": system_prompt}]
+    for msg in history:
+        messages.append(generations.prompt_message(msg, character['name']))
+    return messages
+
+
+def room_turn(characters, history, newer):
+    """(speaker, prompt) for a room reply, given the messages stored since it was queued."""
+    history = history + newer
+    character = pick_character(characters, history)
+    return character['name'], room_prompt(characters, character, history)
 
-                except Exception as e:
-                    error_msg = str(e)
-                    print(f"DeepSeek API error: {error_msg}")
-                    traceback.print_exc()
-                    # Send error message
-                    await self.send(text_data=json.dumps({
+
+class RoomConsumer(ChatConsumer):
+    """Group chat: many users and characters share one conversation.
+
+    Every member's socket joins the conversation group. User messages are
+    broadcast to the room and a single reply per turn is generated for the
+    whole room, by whichever character was addressed (or is next in line).
+    """
+
+    def setup(self):
+        self.room_id = self.scope['url_route']['kwargs']['room_id']
+        self.label = f"room {self.room_id}"
+        self.room = None
+        self.history = []  # Stored messages ({seq, sender, speaker, content}) seen by this socket
+        self.display_name = None
+
+    @database_sync_to_async
+    def get_or_create_room(self, name, characters):
+        room = Room.objects.select_related('conversation').filter(slug=self.room_id).first()
+        if room is None:
+            conversation, created = Conversation.objects.get_or_create(
+                user_session=f"room:{self.room_id}",
+                character_id=int(characters[0].get('id', 0)) if characters else 0,
+                defaults={
+                    'character_name': name or self.room_id,
+                    'character_avatar': characters[0].get('avatar', '') if characters else '',
+                }
+            )
+            room, _ = Room.objects.get_or_create(
+                slug=self.room_id,
+                defaults={
+                    'name': name,
+                    'characters': [],
+                    'created_by': self.session_id,
+                    'conversation': conversation,
+                },
+            )
+            if created:
+                analytics.record(
+                    conversation.character_id, conversation.character_name, self.session_id, conversation.id,
+                    conversations=1,
+                )
+
+        # Only the room's creator may bring in characters; everybody else
+        # gets the room as it is
+        added = []
+        if room.created_by == self.session_id:
+            known = {character.get('name') for character in room.characters}
+            added = [character for character in characters if character.get('name') not in known]
+        if added:
+            room.characters = room.characters + added
+            room.save(update_fields=['characters'])
+
+        print(f"Room {room.slug}: {len(room.characters)} characters")
+        return room, bool(added)
+
+    def reset_context(self):
+        self.history = []
+
+    def add_to_context(self, msg):
+        self.history.append(msg)
+
+    def memory_bytes(self):
+        characters = self.room.characters if self.room else []
+        return connections.estimate_size(self.history) + connections.estimate_size(characters)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = protocol.decode(text_data, bytes_data, self.wire_format)
+            message_type = data.get('type')
+
+            if message_type == 'init':
+                self.session_id = data.get('sessionId') or str(uuid.uuid4())
+                self.display_name = data.get('name') or f"Guest {self.session_id[-4:]}"
+                self.premium = await self.is_subscriber(data.get('token'))
+
+                if not await self.negotiate_format(data):
+                    return
+
+                room = data.get('room', {})
+                self.room, roster_changed = await self.get_or_create_room(
+                    room.get('name', ''), room.get('characters', [])
+                )
+                if not self.room.characters:
+                    await self.send_event({
                         'type': 'error',
-                        'message': f'AI Error: {error_msg}'
-                    }))
+                        'message': 'Room has no characters.'
+                    })
+                    return
+                self.conversation = self.room.conversation
+
+                await self.channel_layer.group_add(
+                    generations.group_name(self.conversation.id), self.channel_name
+                )
+
+                if roster_changed:
+                    await self.channel_layer.group_send(
+                        generations.group_name(self.conversation.id),
+                        {'type': 'chat.roster', 'characters': self.room.characters}
+                    )
+
+                self.version, messages = await self.load_messages()
+                self.set_context(messages)
+                self.evicted = False
+                self.last_activity = time.monotonic()
+                self.initialized = True
+
+                await self.send_roster()
+                await self.send_history(messages, data.get('lastSeq'))
+                await self.send_event({
+                    'type': 'ready'
+                })
+
+            elif message_type == 'message':
+                content = await self.accept_message(data.get('content', ''))
+                if content is None:
+                    return
+                await self.post_message(content, self.display_name)
+
+                # One reply per turn for the whole room. Messages arriving while
+                # a reply is queued are picked up by that reply, and who speaks
+                # is decided when it starts, from the newest message.
+                generations.start(
+                    self.conversation,
+                    functools.partial(room_turn, list(self.room.characters), list(self.history)),
+                    self.seq,
+                    coalesce=True,
+                    premium=self.premium,
+                )
+
+            elif message_type == 'older':
+                await self.send_older(data.get('beforeSeq'))
+
+            elif message_type == 'ping':
+                await self.send_event({
+                    'type': 'pong'
+                })
 
         except Exception as e:
-            print(f"Error processing message: {e}")
+            print(f"Error processing room message: {e}")
             traceback.print_exc()
-            await self.send(text_data=json.dumps({
+            await self.send_event({
                 'type': 'error',
                 'message': str(e)
-            }))
+            })
+
+    async def send_roster(self):
+        await self.send_event({
+            'type': 'room',
+            'name': self.room.name,
+            'characters': [
+                {'id': c.get('id'), 'name': c.get('name'), 'avatar': c.get('avatar', '')}
+                for c in self.room.characters
+            ],
+        })
+
+    async def chat_roster(self, event):
+        """A member brought new characters into the room."""
+        if self.room and event['characters'] != self.room.characters:
+            self.room.characters = event['characters']
+            await self.send_roster()
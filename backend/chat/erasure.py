@@ -0,0 +1,156 @@
+"""Account erasure as a chunked background job.
+
+Deleting a heavy user in one go cascades through every message they ever
+sent in a single transaction. Instead, an ErasureJob deletes the account's
+conversations one at a time, their messages in ID-ordered batches of
+ERASURE_BATCH_SIZE (archived ones a few archives at a time, up to about as
+many messages), each batch in its own short transaction, and deletes the
+user last. Every step re-reads what's left from the database, so a job
+interrupted by a crash or restart simply carries on where it stopped; see
+resume() and `manage.py erase_accounts`.
+"""
+import asyncio
+import traceback
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from .models import Conversation, ErasureJob, Message, MessageArchive, UsageSession
+
+PAUSE = 0.05  # Seconds between batches, so other writers get a turn at the database
+
+_tasks = {}  # job id -> task, for jobs running in this process
+
+
+def sessions(job):
+    """Filter matching the user_session values that belong to the job's user.
+
+    Only sessions the server can tie to the user count: those named
+    user_<id>_..., as the frontend names a logged-in user's sessions.
+    """
+    return Q(user_session__startswith=f"user_{job.user_id}_")
+
+
+def create_job(user):
+    """Schedule erasure of `user`, or return the job already scheduled for them.
+
+    The account is deactivated straight away so it can't log in while the
+    job runs.
+    """
+    with transaction.atomic():
+        job = ErasureJob.objects.filter(user_id=user.id).exclude(status='done').first()
+        if job:
+            return job
+
+        job = ErasureJob(user_id=user.id)
+        conversations = Conversation.objects.filter(sessions(job))
+        job.conversations_total = conversations.count()
+        archived = MessageArchive.objects.filter(conversation__in=conversations).aggregate(
+            total=Sum('message_count')
+        )['total']
+        job.messages_total = Message.objects.filter(conversation__in=conversations).count() + (archived or 0)
+        job.save()
+
+        User.objects.filter(pk=user.id).update(is_active=False)
+    print(f"Erasure {job.id} scheduled: {job.conversations_total} conversations, {job.messages_total} messages")
+    return job
+
+
+def step(job):
+    """Do one bounded batch of work on `job`. Returns True once it's finished."""
+    conversation = Conversation.objects.filter(sessions(job)).order_by('id').first()
+
+    if conversation:
+        ids = list(
+            Message.objects.filter(conversation=conversation)
+            .order_by('id')
+            .values_list('id', flat=True)[:settings.ERASURE_BATCH_SIZE]
+        )
+        archives = [] if ids else _archive_batch(conversation)
+        job.cursor = conversation.id
+        with transaction.atomic():
+            if ids:
+                deleted, _ = Message.objects.filter(
+                    conversation=conversation, id__gte=ids[0], id__lte=ids[-1]
+                ).delete()
+                job.messages_deleted += deleted
+            elif archives:
+                MessageArchive.objects.filter(id__in=[pk for pk, _ in archives]).delete()
+                job.messages_deleted += sum(count for _, count in archives)
+            else:
+                conversation.delete()
+                job.conversations_deleted += 1
+            job.save(update_fields=['messages_deleted', 'conversations_deleted', 'cursor', 'updated_at'])
+        return False
+
+    with transaction.atomic():
+        UsageSession.objects.filter(sessions(job)).delete()
+        User.objects.filter(pk=job.user_id).delete()
+        job.status = 'done'
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'finished_at', 'updated_at'])
+    print(f"Erasure {job.id} done: {job.conversations_deleted} conversations, {job.messages_deleted} messages")
+    return True
+
+
+def _archive_batch(conversation):
+    """(id, message_count) of the next archives to delete: at least one, and
+    no more than ERASURE_BATCH_SIZE messages in total beyond that."""
+    batch, messages = [], 0
+    rows = MessageArchive.objects.filter(conversation=conversation).order_by('id').values_list('id', 'message_count')
+    for pk, count in rows[:settings.ERASURE_BATCH_SIZE]:
+        if batch and messages + count > settings.ERASURE_BATCH_SIZE:
+            break
+        batch.append((pk, count))
+        messages += count
+    return batch
+
+
+def _mark(job, status, error=''):
+    job.status = status
+    job.error = error
+    job.save(update_fields=['status', 'error', 'updated_at'])
+
+
+def run_sync(job):
+    """Run `job` to completion in this thread."""
+    _mark(job, 'running')
+    try:
+        while not step(job):
+            pass
+    except Exception as e:
+        traceback.print_exc()
+        _mark(job, 'failed', str(e))
+        raise
+
+
+async def run(job):
+    """Run `job` to completion, one batch per database call."""
+    await database_sync_to_async(_mark)(job, 'running')
+    try:
+        while not await database_sync_to_async(step)(job):
+            await asyncio.sleep(PAUSE)
+    except Exception as e:
+        print(f"Erasure {job.id} failed: {e}")
+        traceback.print_exc()
+        await database_sync_to_async(_mark)(job, 'failed', str(e))
+
+
+def start(job):
+    """Run `job` in the background on the current event loop, unless it already is."""
+    task = _tasks.get(job.id)
+    if task is None or task.done():
+        task = _tasks[job.id] = asyncio.create_task(run(job))
+        task.add_done_callback(lambda _: _tasks.pop(job.id, None))
+    return task
+
+
+async def resume():
+    """Restart every unfinished job, e.g. after the previous process died mid-erasure."""
+    jobs = [job async for job in ErasureJob.objects.exclude(status='done')]
+    for job in jobs:
+        print(f"Resuming erasure {job.id} ({job.status})")
+        start(job)
+    return len(jobs)
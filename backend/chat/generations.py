@@ -0,0 +1,220 @@
+"""Background reply generation, decoupled from the socket that asked for it.
+
+Replies run as asyncio tasks owned by this module rather than by a consumer,
+so closing the tab never loses a paid completion. Results are persisted and
+then broadcast to the conversation's channel layer group, i.e. to whichever
+sockets are attached to the conversation at that point.
+"""
+import asyncio
+import copy
+import time
+import traceback
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from . import analytics, model_router, pipeline
+from .archive import load_history
+
+_client = None
+_locks = {}  # conversation_id -> asyncio.Lock, one reply at a time per conversation
+_active = {}  # conversation_id -> number of queued or running replies
+_waiting = {}  # conversation_id -> number of replies queued behind the running one
+_tasks = set()  # Strong references so running tasks aren't garbage collected
+
+
+class ReplyRejected(Exception):
+    """The generated reply was rejected by an output pipeline stage."""
+
+
+def get_client():
+    """DeepSeek client shared by every generation in this process."""
+    global _client
+    if _client is None:
+        # openai pulls in hundreds of pydantic models; import on first use
+        from openai import AsyncOpenAI
+        _client = AsyncOpenAI(
+            api_key=settings.DEEPSEEK_API_KEY,
+            base_url="https://api.deepseek.com"
+        )
+    return _client
+
+
+def group_name(conversation_id):
+    """Channel layer group of every socket attached to a conversation."""
+    return f"conversation_{conversation_id}"
+
+
+def is_running(conversation_id):
+    return _active.get(conversation_id, 0) > 0
+
+
+def prompt_message(msg, speaker=''):
+    """Turn a stored message into a chat completion message.
+
+    `speaker` is the character the reply is generated for. In group rooms,
+    everybody else's messages are attributed by name in user turns.
+    """
+    if msg['sender'] == 'character' and msg.get('speaker', '') == speaker:
+        return {"role": "assistant", "content": msg['content']}
+    if msg.get('speaker'):
+        return {"role": "user", "content": f"{msg['speaker']}: {msg['content']}"}
+    role = "user" if msg['sender'] == 'user' else "assistant"
+    return {"role": role, "content": msg['content']}
+
+
+def start(conversation, messages, seq, speaker='', coalesce=False, premium=False):
+    """Queue a reply for `conversation`.
+
+    `messages` is the caller's prompt context, covering the conversation up
+    to message `seq`. Anything persisted after that is loaded from the
+    database before the request is made. `speaker` names the replying
+    character in group rooms. `premium` routes the reply as a subscriber's
+    (see model_router).
+
+    `messages` may instead be a function, called with the messages stored
+    after `seq` once the reply starts, that returns (speaker, messages).
+    Group rooms use it to pick who replies from the newest message.
+
+    With `coalesce`, no new reply is queued if one is already waiting behind
+    the running one, since that one will see the new messages anyway.
+    Returns None in that case.
+    """
+    conversation_id = conversation.id
+    if coalesce and _waiting.get(conversation_id):
+        return None
+    _active[conversation_id] = _active.get(conversation_id, 0) + 1
+    _waiting[conversation_id] = _waiting.get(conversation_id, 0) + 1
+
+    if not callable(messages):
+        messages = list(messages)
+    return spawn(_generate(detached(conversation), messages, seq, speaker, premium))
+
+
+def detached(conversation):
+    """A copy of `conversation` for a background task to append messages to.
+
+    append_message updates the instance it's called on, so the caller's
+    (e.g. a socket's) stays as it was.
+    """
+    return copy.copy(conversation)
+
+
+def spawn(coro):
+    """Run `coro` as a task that shutdown waits for (see wait_idle)."""
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def wait_idle(timeout):
+    """Wait up to `timeout` seconds for every queued and running reply.
+
+    Replies started while waiting are waited for too. Returns how many are
+    still unfinished.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while _tasks:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        await asyncio.wait(set(_tasks), timeout=remaining)
+    return len(_tasks)
+
+
+async def _generate(conversation, messages, seq, speaker, premium):
+    conversation_id = conversation.id
+    group = group_name(conversation_id)
+    channel_layer = get_channel_layer()
+    lock = _locks.setdefault(conversation_id, asyncio.Lock())
+
+    try:
+        async with lock:
+            _waiting[conversation_id] -= 1
+            newer = await database_sync_to_async(load_history)(conversation, seq)
+            if callable(messages):
+                speaker, messages = messages(newer)
+                await channel_layer.group_send(group, {'type': 'chat.typing', 'speaker': speaker})
+            else:
+                for msg in newer:
+                    messages.append(prompt_message(msg, speaker))
+
+            # Seqs count the conversation's messages, archived ones included
+            turns = newer[-1]['seq'] if newer else seq
+            route = model_router.route(messages, premium, turns)
+            print(f"Calling DeepSeek API ({route.name}: {route.model})...")
+            started = time.monotonic()
+            try:
+                response = await get_client().chat.completions.create(
+                    model=route.model,
+                    messages=messages,
+                    max_tokens=route.max_tokens,
+                    temperature=route.temperature,
+                )
+            except Exception:
+                model_router.observe(route, time.monotonic() - started, error=True)
+                raise
+            usage = getattr(response, 'usage', None)
+            model_router.observe(route, time.monotonic() - started, usage)
+
+            ai_message = response.choices[0].message.content
+            print(f"AI response: {ai_message[:50]}...")
+
+            verdict = pipeline.process_output(ai_message)
+            if verdict.rejected:
+                raise ReplyRejected(verdict.reason)
+            ai_message = verdict.text
+
+            reply = await database_sync_to_async(_save_reply)(
+                conversation, ai_message, speaker, usage.total_tokens if usage else 0
+            )
+
+        _finish(conversation_id)
+        await channel_layer.group_send(group, {
+            'type': 'chat.message',
+            'content': ai_message,
+            'seq': reply.seq,
+            'version': conversation.version,
+            'speaker': speaker,
+        })
+
+    except ReplyRejected as e:
+        _finish(conversation_id)
+        print(f"Reply rejected: {e}")
+        await database_sync_to_async(_record_error)(conversation)
+        await channel_layer.group_send(group, {
+            'type': 'chat.error',
+            'message': str(e),
+        })
+
+    except Exception as e:
+        _finish(conversation_id)
+        error_msg = str(e)
+        print(f"DeepSeek API error: {error_msg}")
+        traceback.print_exc()
+        await database_sync_to_async(_record_error)(conversation)
+        await channel_layer.group_send(group, {
+            'type': 'chat.error',
+            'message': f'AI Error: {error_msg}',
+        })
+
+
+def _save_reply(conversation, content, speaker, tokens):
+    reply = conversation.append_message('character', content, speaker)
+    analytics.record(
+        conversation.character_id, conversation.character_name, conversation=conversation.id, messages=1, tokens=tokens
+    )
+    return reply
+
+
+def _record_error(conversation):
+    analytics.record(conversation.character_id, conversation.character_name, errors=1)
+
+
+def _finish(conversation_id):
+    _active[conversation_id] -= 1
+    if not _active[conversation_id]:
+        del _active[conversation_id]
+        _waiting.pop(conversation_id, None)
+        _locks.pop(conversation_id, None)
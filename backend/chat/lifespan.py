@@ -0,0 +1,95 @@
+"""Graceful shutdown for deploys.
+
+On SIGTERM (or the ASGI lifespan shutdown event, whichever comes first) the
+process starts draining: new sockets are turned away, replies already queued
+or running get up to SHUTDOWN_DRAIN_SECONDS to finish and be saved, buffered
+usage counters are flushed, and only then are open sockets closed with 1012
+(service restart) and a randomised retry delay, so clients don't all
+reconnect in the same instant.
+
+Uvicorn closes every socket as soon as it sees SIGTERM, before the lifespan
+shutdown event, so the signal handler defers it until the drain is done.
+"""
+import asyncio
+import random
+import signal
+import threading
+from channels.db import database_sync_to_async
+from django.conf import settings
+from . import analytics, connections, erasure, generations
+from .warmup import warm_up
+
+_drain = None  # asyncio.Task once draining has started
+
+
+def is_draining():
+    return _drain is not None
+
+
+def retry_after_ms():
+    """Randomised reconnect delay for a client being sent away."""
+    return random.randint(settings.RECONNECT_MIN_MS, settings.RECONNECT_MAX_MS)
+
+
+def drain():
+    """Start draining this process. Returns a task that finishes when it's done."""
+    global _drain
+    if _drain is None:
+        _drain = asyncio.ensure_future(_run_drain())
+    return _drain
+
+
+async def _run_drain():
+    print(f"Draining: {len(generations._tasks)} replies in flight, {len(connections.open_consumers())} sockets open")
+
+    pending = await generations.wait_idle(settings.SHUTDOWN_DRAIN_SECONDS)
+    if pending:
+        print(f"Drain deadline passed with {pending} replies still running")
+
+    await database_sync_to_async(analytics.flush)()
+
+    for consumer in connections.open_consumers():
+        try:
+            await consumer.send_reconnect(1012)
+        except Exception as e:
+            print(f"Error closing socket during drain: {e}")
+
+    print("Drain complete")
+
+
+def _install_signal_handler(loop):
+    """Drain before letting the server's own SIGTERM handler run."""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+    if not callable(previous):
+        return
+
+    def handle_sigterm(signum, frame):
+        if is_draining():
+            previous(signum, frame)  # Second SIGTERM: stop waiting
+            return
+
+        def begin():
+            drain().add_done_callback(lambda task: previous(signum, frame))
+        loop.call_soon_threadsafe(begin)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+
+class LifespanApp:
+    """ASGI app for the 'lifespan' scope."""
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                _install_signal_handler(asyncio.get_running_loop())
+                if settings.WARMUP_ON_STARTUP:
+                    warm_up()
+                await erasure.resume()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await drain()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
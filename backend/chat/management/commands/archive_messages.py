@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from chat.archive import archive_old_messages
+
+
+class Command(BaseCommand):
+    help = 'Move old messages into compressed per-conversation archives.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.MESSAGE_RETENTION_DAYS,
+            help='Archive messages older than this many days (default: MESSAGE_RETENTION_DAYS).',
+        )
+
+    def handle(self, *args, **options):
+        conversations, messages = archive_old_messages(days=options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {messages} messages from {conversations} conversations."
+        ))
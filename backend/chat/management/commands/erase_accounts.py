@@ -0,0 +1,36 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from chat.erasure import run_sync
+from chat.models import ErasureJob
+
+
+class Command(BaseCommand):
+    help = 'Finish account erasure jobs that were interrupted (e.g. by a crash).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale-minutes',
+            type=int,
+            default=10,
+            help='Treat pending/running jobs with no progress for this long as interrupted (default: 10).',
+        )
+
+    def handle(self, *args, **options):
+        stale = timezone.now() - timedelta(minutes=options['stale_minutes'])
+        jobs = ErasureJob.objects.filter(
+            Q(status='failed') | Q(status__in=['pending', 'running'], updated_at__lt=stale)
+        ).order_by('created_at')
+
+        finished = 0
+        for job in jobs:
+            self.stdout.write(f"Erasing user {job.user_id} (job {job.id}, {job.status})...")
+            try:
+                run_sync(job)
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"Job {job.id} failed: {e}"))
+                continue
+            finished += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Finished {finished} erasure jobs."))
@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+WARMUP_MARKER = 'importtime: warm_up'
+
+# Import the ASGI module, then run what the lifespan startup handler runs,
+# reporting how long warm_up() took on a line of its own
+STARTUP_CODE = (
+    "import sys, time; import django; django.setup(); "
+    "import backend.asgi; "
+    f"sys.stderr.write({WARMUP_MARKER!r} + '\\n'); "
+    "from chat.warmup import warm_up; "
+    "started = time.perf_counter(); warm_up(); "
+    f"sys.stderr.write({WARMUP_MARKER!r} + ' %d\\n' % ((time.perf_counter() - started) * 1e6))"
+)
+
+
+class Command(BaseCommand):
+    help = 'Report where worker startup time goes (python -X importtime breakdown).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='Rows to show per table.')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'backend.settings'))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_CODE],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            self.stderr.write(result.stderr)
+            return
+
+        # Imports before the first marker are the ASGI module's, the rest warm_up()'s
+        modules, warmup_modules = [], []
+        phase, warmup_us = modules, 0
+        for line in result.stderr.splitlines():
+            if line.startswith(WARMUP_MARKER):
+                phase = warmup_modules
+                warmup_us = int(line[len(WARMUP_MARKER):] or 0)
+                continue
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            phase.append((name.strip(), int(self_us), int(cumulative_us)))
+
+        # Self time summed per top-level package
+        packages = defaultdict(int)
+        for name, self_us, _ in modules:
+            packages[name.split('.')[0]] += self_us
+
+        limit = options['limit']
+        total = sum(packages.values())
+        self.stdout.write(f"Total import time: {total / 1000:.1f} ms ({len(modules)} modules)\n")
+
+        self.stdout.write("Top packages (self time):")
+        for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:limit]:
+            self.stdout.write(f"  {self_us / 1000:8.1f} ms  {self_us * 100 / total:5.1f}%  {name}")
+
+        self.stdout.write("\nTop modules (cumulative time):")
+        for name, _, cumulative_us in sorted(modules, key=lambda item: -item[2])[:limit]:
+            self.stdout.write(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+        warmup_import_us = sum(self_us for _, self_us, _ in warmup_modules)
+        self.stdout.write(
+            f"\nwarm_up(): {warmup_us / 1000:.1f} ms, "
+            f"of which {warmup_import_us / 1000:.1f} ms importing {len(warmup_modules)} modules"
+        )
+        for name, _, cumulative_us in sorted(warmup_modules, key=lambda item: -item[2])[:limit]:
+            self.stdout.write(f"  {cumulative_us / 1000:8.1f} ms  {name}")
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:26
+
+import gzip
+import json
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000  # Messages numbered per UPDATE
+
+
+def number_messages(apps, schema_editor):
+    """Assign per-conversation sequence numbers to existing messages, archives first."""
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    MessageArchive = apps.get_model('chat', 'MessageArchive')
+
+    for conversation in Conversation.objects.all().iterator():
+        seq = 0
+
+        for archive in MessageArchive.objects.filter(conversation=conversation).order_by('first_message_at', 'id'):
+            rows = json.loads(gzip.decompress(bytes(archive.data)).decode('utf-8'))
+            archive.first_seq = seq + 1
+            for row in rows:
+                seq += 1
+                row['seq'] = seq
+            archive.last_seq = seq
+            archive.data = gzip.compress(json.dumps(rows, separators=(',', ':')).encode('utf-8'))
+            archive.save(update_fields=['data', 'first_seq', 'last_seq'])
+
+        messages = list(Message.objects.filter(conversation=conversation).order_by('created_at', 'id').only('id'))
+        for message in messages:
+            seq += 1
+            message.seq = seq
+        Message.objects.bulk_update(messages, ['seq'], batch_size=BATCH_SIZE)
+
+        conversation.last_seq = seq
+        conversation.save(update_fields=['last_seq'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_message_archive'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='message',
+            options={'ordering': ['seq']},
+        ),
+        migrations.AlterModelOptions(
+            name='messagearchive',
+            options={'ordering': ['first_seq']},
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_seq',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='messagearchive',
+            name='first_seq',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='messagearchive',
+            name='last_seq',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(number_messages, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='message',
+            unique_together={('conversation', 'seq')},
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='speaker',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.CreateModel(
+            name='Room',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(max_length=100, unique=True)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('characters', models.JSONField(default=list)),
+                ('created_by', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='room', to='chat.conversation')),
+            ],
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_conversation_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('character_id', models.IntegerField()),
+                ('character_name', models.CharField(blank=True, max_length=100)),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('conversations', models.PositiveIntegerField(default=0)),
+                ('unique_sessions', models.PositiveIntegerField(default=0)),
+                ('active_conversations', models.PositiveIntegerField(default=0)),
+                ('tokens', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-bucket_start', 'character_id'],
+                'unique_together': {('period', 'bucket_start', 'character_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='UsageSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('character_id', models.IntegerField()),
+                ('user_session', models.CharField(max_length=255)),
+            ],
+            options={
+                'unique_together': {('period', 'bucket_start', 'character_id', 'user_session')},
+            },
+        ),
+        migrations.CreateModel(
+            name='UsageConversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('character_id', models.IntegerField()),
+                ('conversation_id', models.IntegerField()),
+            ],
+            options={
+                'unique_together': {('period', 'bucket_start', 'character_id', 'conversation_id')},
+            },
+        ),
+    ]
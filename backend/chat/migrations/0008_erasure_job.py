@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:47
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_usage_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ErasureJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('user_id', models.IntegerField(db_index=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('conversations_total', models.PositiveIntegerField(default=0)),
+                ('conversations_deleted', models.PositiveIntegerField(default=0)),
+                ('messages_total', models.PositiveIntegerField(default=0)),
+                ('messages_deleted', models.PositiveIntegerField(default=0)),
+                ('cursor', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,104 @@
+"""Pick the model and sampling parameters for each reply.
+
+Routes are defined in settings.MODEL_ROUTES. Subscribers get
+MODEL_ROUTE_PREMIUM; long conversations and demanding messages get
+MODEL_ROUTE_COMPLEX; plain chit-chat gets MODEL_ROUTE_DEFAULT. observe()
+keeps per-route latency and cost figures so the thresholds can be tuned.
+"""
+import re
+from collections import defaultdict, deque, namedtuple
+from django.conf import settings
+
+Route = namedtuple('Route', ['name', 'model', 'max_tokens', 'temperature'])
+
+# Words that usually ask for more than a quick conversational reply
+DEMANDING_WORDS = frozenset([
+    'explain', 'why', 'how', 'describe', 'story', 'write', 'plan', 'compare',
+    'imagine', 'advice', 'help', 'think', 'remember', 'detail', 'poem',
+])
+WORD = re.compile(r"[a-z']+")
+
+_stats = defaultdict(lambda: {
+    'requests': 0,
+    'errors': 0,
+    'prompt_tokens': 0,
+    'completion_tokens': 0,
+    'cost': 0.0,
+    'latencies': deque(maxlen=1000),  # Seconds, most recent requests
+})
+
+
+def get_route(name):
+    config = settings.MODEL_ROUTES[name]
+    return Route(name, config['model'], config['max_tokens'], config['temperature'])
+
+
+def complexity(text):
+    """Cheap 0..1 score of how demanding a user message is."""
+    words = WORD.findall(text.lower())
+    score = min(len(words) / 60, 1) * 0.5
+    score += min(text.count('?'), 2) * 0.1
+    if '\n' in text.strip():
+        score += 0.1
+    if DEMANDING_WORDS.intersection(words):
+        score += 0.2
+    return min(score, 1.0)
+
+
+def route(messages, premium=False, turns=None):
+    """Route for a reply to `messages` (the prompt, system message included).
+
+    `turns` is the number of messages in the whole conversation, which the
+    prompt may only hold the newest of; by default the prompt is counted.
+    """
+    if premium:
+        return get_route(settings.MODEL_ROUTE_PREMIUM)
+
+    if turns is None:
+        turns = sum(1 for msg in messages if msg['role'] != 'system')
+    last = next((msg['content'] for msg in reversed(messages) if msg['role'] == 'user'), '')
+    if turns >= settings.MODEL_ROUTE_LONG_TURNS or complexity(last) >= settings.MODEL_ROUTE_COMPLEXITY:
+        return get_route(settings.MODEL_ROUTE_COMPLEX)
+    return get_route(settings.MODEL_ROUTE_DEFAULT)
+
+
+def observe(route, seconds, usage=None, error=False):
+    """Record one completion request made on `route`."""
+    stats = _stats[route.name]
+    stats['requests'] += 1
+    stats['latencies'].append(seconds)
+    if error:
+        stats['errors'] += 1
+    if usage is not None:
+        config = settings.MODEL_ROUTES[route.name]
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        stats['prompt_tokens'] += prompt_tokens
+        stats['completion_tokens'] += completion_tokens
+        stats['cost'] += (
+            prompt_tokens * config.get('input_price', 0) + completion_tokens * config.get('output_price', 0)
+        ) / 1_000_000
+
+
+def _percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def report():
+    """Per-route request counts, latency (ms) and cost (USD) since startup."""
+    routes = {}
+    for name, stats in _stats.items():
+        latencies = sorted(stats['latencies'])
+        requests = stats['requests']
+        routes[name] = {
+            'model': settings.MODEL_ROUTES.get(name, {}).get('model', ''),
+            'requests': requests,
+            'errors': stats['errors'],
+            'p50_ms': round(_percentile(latencies, 0.5) * 1000) if latencies else None,
+            'p95_ms': round(_percentile(latencies, 0.95) * 1000) if latencies else None,
+            'prompt_tokens': stats['prompt_tokens'],
+            'completion_tokens': stats['completion_tokens'],
+            'cost_usd': round(stats['cost'], 6),
+            'cost_per_request_usd': round(stats['cost'] / requests, 6) if requests else None,
+        }
+    return {'routes': routes}
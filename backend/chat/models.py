@@ -1,5 +1,12 @@
-from django.db import models
+import uuid
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+
+class StaleConversation(Exception):
+    """The conversation changed since the caller last read it."""
 
 
 class Conversation(models.Model):
@@ -8,6 +15,8 @@ class Conversation(models.Model):
     character_id = models.IntegerField()
     character_name = models.CharField(max_length=100)
     character_avatar = models.URLField(max_length=500, blank=True)
+    last_seq = models.PositiveIntegerField(default=0)  # seq of the newest message
+    version = models.PositiveIntegerField(default=0)  # Bumped on every change to the history
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -18,6 +27,37 @@ class Conversation(models.Model):
     def __str__(self):
         return f"Conversation with {self.character_name} ({self.user_session[:8]}...)"
 
+    def append_message(self, sender, content, speaker='', expected_version=None):
+        """Store a new message with the next sequence number of this conversation.
+
+        With `expected_version`, the append only happens if nobody else has
+        changed the history since that version was read; otherwise
+        StaleConversation is raised and nothing is written.
+        """
+        with transaction.atomic():
+            # The UPDATE takes the row lock, so concurrent appends get distinct seqs
+            rows = Conversation.objects.filter(pk=self.pk)
+            if expected_version is not None:
+                rows = rows.filter(version=expected_version)
+            updated = rows.update(
+                last_seq=F('last_seq') + 1,
+                version=F('version') + 1,
+                updated_at=timezone.now(),
+            )
+            if not updated:
+                raise StaleConversation(self.pk)
+
+            self.last_seq, self.version = Conversation.objects.values_list(
+                'last_seq', 'version'
+            ).get(pk=self.pk)
+            return Message.objects.create(
+                conversation=self,
+                sender=sender,
+                content=content,
+                speaker=speaker,
+                seq=self.last_seq,
+            )
+
 
 class Message(models.Model):
     """Represents a single message in a conversation."""
@@ -32,16 +72,106 @@ class Message(models.Model):
         related_name='messages'
     )
     sender = models.CharField(max_length=10, choices=SENDER_CHOICES)
+    speaker = models.CharField(max_length=100, blank=True)  # Display name, set in group rooms
     content = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    seq = models.PositiveIntegerField(default=0)  # Monotonic per conversation, starts at 1
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     class Meta:
-        ordering = ['created_at']
+        ordering = ['seq']
+        unique_together = ['conversation', 'seq']
 
     def __str__(self):
         return f"{self.sender}: {self.content[:50]}..."
 
 
+class MessageArchive(models.Model):
+    """A gzip-compressed batch of old messages moved out of the Message table."""
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='archives'
+    )
+    data = models.BinaryField()  # gzip'd JSON list of {seq, sender, content, created_at}
+    message_count = models.IntegerField()
+    first_seq = models.PositiveIntegerField(default=0)
+    last_seq = models.PositiveIntegerField(default=0)
+    first_message_at = models.DateTimeField()
+    last_message_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['first_seq']
+
+    def __str__(self):
+        return f"Archive of {self.message_count} messages ({self.conversation_id})"
+
+
+class Room(models.Model):
+    """A group chat: several users and/or characters sharing one conversation."""
+    slug = models.SlugField(max_length=100, unique=True)
+    name = models.CharField(max_length=100, blank=True)
+    characters = models.JSONField(default=list)  # [{id, name, avatar, systemPrompt}, ...]
+    created_by = models.CharField(max_length=255, blank=True)  # Session that may change the characters
+    conversation = models.OneToOneField(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='room'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Room {self.name or self.slug}"
+
+
+class UsageRollup(models.Model):
+    """Pre-aggregated usage per character per hour or day, for the admin dashboard."""
+    PERIOD_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket_start = models.DateTimeField()
+    character_id = models.IntegerField()
+    character_name = models.CharField(max_length=100, blank=True)
+    messages = models.PositiveIntegerField(default=0)
+    conversations = models.PositiveIntegerField(default=0)  # Conversations started
+    unique_sessions = models.PositiveIntegerField(default=0)
+    active_conversations = models.PositiveIntegerField(default=0)  # Conversations with any activity
+    tokens = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-bucket_start', 'character_id']
+        unique_together = ['period', 'bucket_start', 'character_id']
+
+    def __str__(self):
+        return f"{self.character_name} {self.period} {self.bucket_start:%Y-%m-%d %H:%M}"
+
+
+class UsageSession(models.Model):
+    """Sessions already counted in a UsageRollup bucket."""
+    period = models.CharField(max_length=4)
+    bucket_start = models.DateTimeField()
+    character_id = models.IntegerField()
+    user_session = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ['period', 'bucket_start', 'character_id', 'user_session']
+
+
+class UsageConversation(models.Model):
+    """Conversations already counted in a UsageRollup bucket."""
+    period = models.CharField(max_length=4)
+    bucket_start = models.DateTimeField()
+    character_id = models.IntegerField()
+    conversation_id = models.IntegerField()
+
+    class Meta:
+        unique_together = ['period', 'bucket_start', 'character_id', 'conversation_id']
+
+
 class Subscription(models.Model):
     """Tracks a user's Stripe subscription."""
     STATUS_CHOICES = [
@@ -66,3 +196,41 @@ class Subscription(models.Model):
     @property
     def is_active(self):
         return self.status in ('active', 'trialing')
+
+
+class ErasureJob(models.Model):
+    """Background erasure of a deleted account and the conversations linked to it."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user_id = models.IntegerField(db_index=True)  # Not a foreign key: the job outlives the user
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    conversations_total = models.PositiveIntegerField(default=0)
+    conversations_deleted = models.PositiveIntegerField(default=0)
+    messages_total = models.PositiveIntegerField(default=0)
+    messages_deleted = models.PositiveIntegerField(default=0)
+    cursor = models.PositiveIntegerField(default=0)  # Conversation currently being erased
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Erasure of user {self.user_id} ({self.status})"
+
+    @property
+    def progress(self):
+        if self.status == 'done':
+            return 1.0
+        total = self.messages_total + self.conversations_total
+        if not total:
+            return 0.0
+        return min((self.messages_deleted + self.conversations_deleted) / total, 1.0)
@@ -0,0 +1,143 @@
+"""Local content moderation, run before any paid API call.
+
+Term lists are matched in a single pass with an Aho-Corasick automaton, so
+the cost doesn't grow with the number of terms. Verdicts are cached by a
+hash of the text, and an optional classifier (any callable returning a
+0..1 score) can be plugged in through settings.
+"""
+import hashlib
+import re
+from collections import OrderedDict, deque
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .pipeline import Verdict
+
+
+def _lower(char):
+    """Lowercase a single character, keeping it a single character.
+
+    A few characters lowercase to more than one ('İ' becomes 'i' plus a
+    combining dot); only the first is kept, so indexes into the lowered
+    text stay indexes into the original.
+    """
+    return char.lower()[0]
+
+
+class Automaton:
+    """Aho-Corasick automaton over a fixed set of lowercase terms."""
+
+    def __init__(self, terms):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for term in terms:
+            term = ''.join(_lower(char) for char in term.strip())
+            if not term:
+                continue
+            state = 0
+            for char in term:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(term)
+
+        # Breadth-first pass to fill in failure links
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def __bool__(self):
+        return len(self.goto) > 1
+
+    def find(self, text):
+        """Yield (start, end) spans of whole-word term matches in `text`."""
+        state = 0
+        for index, char in enumerate(text):
+            char = _lower(char)
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for term in self.output[state]:
+                start, end = index - len(term) + 1, index + 1
+                if _is_word_start(text, start) and _is_word_end(text, end):
+                    yield start, end
+
+
+def _is_word_start(text, index):
+    return index == 0 or not text[index - 1].isalnum()
+
+
+def _is_word_end(text, index):
+    return index == len(text) or not text[index].isalnum()
+
+
+def redact(text, spans):
+    chars = list(text)
+    for start, end in spans:
+        chars[start:end] = '*' * (end - start)
+    return ''.join(chars)
+
+
+ALLOWED = True  # Cache entry for an allowed text
+
+
+class ModerationStage:
+    """Pipeline stage that rejects or redacts user input and model output."""
+
+    def __init__(self):
+        self.blocked = Automaton(settings.MODERATION_BLOCKED_TERMS)
+        self.redacted = Automaton(settings.MODERATION_REDACTED_TERMS)
+        self.patterns = (
+            re.compile('|'.join(f'(?:{p})' for p in settings.MODERATION_PATTERNS), re.IGNORECASE)
+            if settings.MODERATION_PATTERNS else None
+        )
+        self.classifier = (
+            import_string(settings.MODERATION_CLASSIFIER) if settings.MODERATION_CLASSIFIER else None
+        )
+        self.cache = OrderedDict()  # blake2b(text) -> Verdict, or ALLOWED so allowed texts aren't kept
+
+    def check(self, text):
+        key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        verdict = self.cache.get(key)
+        if verdict is not None:
+            self.cache.move_to_end(key)
+            return Verdict.allow(text) if verdict is ALLOWED else verdict
+
+        verdict = self.classify(text)
+        self.cache[key] = ALLOWED if verdict.action == 'allow' else verdict
+        if len(self.cache) > settings.MODERATION_CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return verdict
+
+    def classify(self, text):
+        if self.blocked and next(self.blocked.find(text), None):
+            return Verdict.reject('Message blocked by content filter.')
+        if self.patterns and self.patterns.search(text):
+            return Verdict.reject('Message blocked by content filter.')
+        if self.classifier and self.classifier(text) >= settings.MODERATION_CLASSIFIER_THRESHOLD:
+            return Verdict.reject('Message blocked by content filter.')
+
+        if self.redacted:
+            spans = list(self.redacted.find(text))
+            if spans:
+                return Verdict.redact(redact(text, spans))
+        return Verdict.allow(text)
+
+    def process_input(self, text):
+        return self.check(text)
+
+    def process_output(self, text):
+        return self.check(text)
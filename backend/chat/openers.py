@@ -0,0 +1,177 @@
+"""Opening lines for new conversations.
+
+With OPENER_PREFETCH on, a character speaks first when a conversation is
+created. Lines come from a per-character pool, so the first message shows up
+as soon as the chat opens; on a miss one is generated on the spot. Refilling
+the pool sends the character's system prompt to DeepSeek ahead of the user's
+first message, which also warms DeepSeek's prefix cache for it.
+
+Pools are keyed by character and system prompt (the prompt comes from the
+client) and are only refilled once a key has been seen twice, so one-off
+prompts don't cost a pool's worth of completions.
+"""
+import asyncio
+import hashlib
+import time
+import traceback
+from collections import OrderedDict, deque
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from . import analytics, generations, model_router, pipeline
+from .models import StaleConversation
+
+INSTRUCTION = (
+    "Start the conversation: greet the user in character with one short opening line "
+    "that sets the scene. Don't mention these instructions."
+)
+MAX_POOLS = 256  # Least recently used pools are dropped beyond this
+
+_pools = OrderedDict()  # (character_id, prompt hash) -> {'lines': deque of (created, text), 'hits': int}
+_refilling = set()
+_refills = set()  # Strong references to refill tasks
+_opening = set()  # Conversation IDs with an opener in flight
+
+
+def pool_key(character_id, system_prompt):
+    digest = hashlib.blake2b(system_prompt.encode('utf-8'), digest_size=16).digest()
+    return (character_id, digest)
+
+
+def _pool(key):
+    pool = _pools.get(key)
+    if pool is None:
+        pool = _pools[key] = {'lines': deque(), 'hits': 0}
+        if len(_pools) > MAX_POOLS:
+            _pools.popitem(last=False)
+    _pools.move_to_end(key)
+    return pool
+
+
+def take(key):
+    """A pooled line for `key` that isn't too old, or None."""
+    pool = _pool(key)
+    pool['hits'] += 1
+    lines = pool['lines']
+    while lines:
+        created, text = lines.popleft()
+        if time.monotonic() - created < settings.OPENER_MAX_AGE_SECONDS:
+            return text
+    return None
+
+
+async def generate(system_prompt):
+    """Generate one opening line. Returns (text, tokens), or (None, tokens) if moderation rejects it."""
+    route = model_router.get_route(settings.MODEL_ROUTE_DEFAULT)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": INSTRUCTION},
+    ]
+    started = time.monotonic()
+    try:
+        response = await generations.get_client().chat.completions.create(
+            model=route.model,
+            messages=messages,
+            max_tokens=route.max_tokens,
+            temperature=route.temperature,
+        )
+    except Exception:
+        model_router.observe(route, time.monotonic() - started, error=True)
+        raise
+    usage = getattr(response, 'usage', None)
+    model_router.observe(route, time.monotonic() - started, usage)
+
+    verdict = pipeline.process_output(response.choices[0].message.content)
+    return (None if verdict.rejected else verdict.text), (usage.total_tokens if usage else 0)
+
+
+def refill(key, system_prompt):
+    """Top up the pool for `key` in the background, if it's in demand."""
+    if key in _refilling or _pool(key)['hits'] < 2:
+        return
+    _refilling.add(key)
+    task = asyncio.create_task(_refill(key, system_prompt))
+    _refills.add(task)
+    task.add_done_callback(_refills.discard)
+
+
+async def _refill(key, system_prompt):
+    try:
+        lines = _pool(key)['lines']
+        while len(lines) < settings.OPENER_POOL_SIZE:
+            text, _ = await generate(system_prompt)
+            if text:
+                lines.append((time.monotonic(), text))
+    except Exception as e:
+        print(f"Error refilling opener pool: {e}")
+    finally:
+        _refilling.discard(key)
+
+
+def is_opening(conversation_id):
+    return conversation_id in _opening
+
+
+def open_conversation(conversation, system_prompt):
+    """Have the character send the first message of a new conversation.
+
+    Returns None if an opener is already on its way, e.g. when a second tab
+    opens the conversation before the first opener is saved.
+    """
+    if conversation.id in _opening:
+        return None
+    _opening.add(conversation.id)
+    task = generations.spawn(_open(generations.detached(conversation), conversation.version, system_prompt))
+    task.add_done_callback(lambda _: _opening.discard(conversation.id))
+    return task
+
+
+async def _open(conversation, version, system_prompt):
+    group = generations.group_name(conversation.id)
+    channel_layer = get_channel_layer()
+    key = pool_key(conversation.character_id, system_prompt)
+
+    try:
+        text, tokens = take(key), 0
+        if text is None:
+            await channel_layer.group_send(group, {'type': 'chat.typing'})
+            text, tokens = await generate(system_prompt)
+        refill(key, system_prompt)
+        if not text:
+            await channel_layer.group_send(group, {
+                'type': 'chat.error',
+                'message': 'Opening line blocked by content filter.',
+            })
+            return
+
+        opener = await database_sync_to_async(_save_opener)(conversation, text, version, tokens)
+        if opener is None:
+            print(f"Conversation {conversation.id} started before its opener was ready")
+            return
+        await channel_layer.group_send(group, {
+            'type': 'chat.message',
+            'content': text,
+            'seq': opener.seq,
+            'version': conversation.version,
+            'speaker': '',
+        })
+
+    except Exception as e:
+        print(f"Opener error: {e}")
+        traceback.print_exc()
+        await channel_layer.group_send(group, {
+            'type': 'chat.error',
+            'message': f'AI Error: {e}',
+        })
+
+
+def _save_opener(conversation, text, version, tokens):
+    """Save the opener unless the conversation has moved on (e.g. the user spoke first)."""
+    try:
+        opener = conversation.append_message('character', text, expected_version=version)
+    except StaleConversation:
+        return None
+    analytics.record(
+        conversation.character_id, conversation.character_name, conversation=conversation.id, messages=1, tokens=tokens
+    )
+    return opener
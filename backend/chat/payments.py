@@ -0,0 +1,64 @@
+from django.conf import settings
+from .models import Subscription
+
+_stripe = None
+_client = None
+
+
+def get_stripe():
+    """The stripe module, configured with our secret key.
+
+    stripe is imported on first use rather than at startup; it is one of the
+    heaviest imports in the project and most requests never touch it.
+    """
+    global _stripe
+    if _stripe is None:
+        import stripe
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        _stripe = stripe
+    return _stripe
+
+
+def get_stripe_client():
+    """Process-wide StripeClient on an HTTPX transport.
+
+    The HTTPX pools keep connections to api.stripe.com alive between
+    requests, and the *_async methods let async views await Stripe without
+    holding a worker thread.
+    """
+    global _client
+    if _client is None:
+        stripe = get_stripe()
+        _client = stripe.StripeClient(
+            settings.STRIPE_SECRET_KEY,
+            http_client=stripe.HTTPXClient(allow_sync_methods=True),
+        )
+    return _client
+
+
+async def create_customer_async(user):
+    """Create the Stripe customer for a user. Returns the customer ID."""
+    customer = await get_stripe_client().customers.create_async(params={
+        'email': user.email,
+        'metadata': {'user_id': user.id},
+    })
+    return customer.id
+
+
+async def precreate_customer(user):
+    """Create a new user's Stripe customer in the background after signup.
+
+    Leaves any customer checkout created in the meantime in place.
+    """
+    try:
+        customer_id = await create_customer_async(user)
+    except get_stripe().error.StripeError as e:
+        print(f"Stripe customer creation failed for {user.id}: {e}")
+        return
+    subscription, created = await Subscription.objects.aget_or_create(
+        user=user, defaults={'stripe_customer_id': customer_id}
+    )
+    if not created:
+        await Subscription.objects.filter(pk=subscription.pk, stripe_customer_id='').aupdate(
+            stripe_customer_id=customer_id
+        )
@@ -0,0 +1,61 @@
+"""Pre/post-processing stages around reply generation.
+
+Stages are listed by dotted path in settings.CHAT_PIPELINE. Each stage has
+process_input(text) and process_output(text) methods returning a Verdict;
+input stages run before the user message is stored or sent anywhere,
+output stages before a reply is stored and delivered.
+"""
+from collections import namedtuple
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class Verdict(namedtuple('Verdict', ['action', 'text', 'reason'])):
+    """What a stage decided: 'allow', 'redact' (use `text`) or 'reject'."""
+
+    @classmethod
+    def allow(cls, text):
+        return cls('allow', text, '')
+
+    @classmethod
+    def redact(cls, text):
+        return cls('redact', text, '')
+
+    @classmethod
+    def reject(cls, reason):
+        return cls('reject', None, reason)
+
+    @property
+    def rejected(self):
+        return self.action == 'reject'
+
+
+_stages = None
+
+
+def get_stages():
+    global _stages
+    if _stages is None:
+        _stages = [import_string(path)() for path in settings.CHAT_PIPELINE]
+    return _stages
+
+
+def _run(method, text):
+    verdict = Verdict.allow(text)
+    for stage in get_stages():
+        result = getattr(stage, method)(verdict.text)
+        if result.rejected:
+            return result
+        if result.action == 'redact':
+            verdict = result
+    return verdict
+
+
+def process_input(text):
+    """Run the user's message through every stage."""
+    return _run('process_input', text)
+
+
+def process_output(text):
+    """Run a generated reply through every stage."""
+    return _run('process_output', text)
@@ -0,0 +1,32 @@
+"""Wire formats for the chat WebSocket.
+
+Clients pick a format with the `format` field of their `init` frame. JSON
+frames go out as text, msgpack and CBOR frames as binary. The `init` frame
+itself is always JSON text.
+"""
+import cbor2
+import msgpack
+import ujson
+
+DEFAULT_FORMAT = 'json'
+FORMATS = ('json', 'msgpack', 'cbor')
+
+
+def encode(payload, fmt=DEFAULT_FORMAT):
+    """Encode a frame. Returns a (text_data, bytes_data) pair for `send`."""
+    if fmt == 'msgpack':
+        return None, msgpack.packb(payload, use_bin_type=True)
+    if fmt == 'cbor':
+        return None, cbor2.dumps(payload)
+    return ujson.dumps(payload, ensure_ascii=False), None
+
+
+def decode(text_data=None, bytes_data=None, fmt=DEFAULT_FORMAT):
+    """Decode an incoming frame. Text frames are always JSON."""
+    if text_data is not None:
+        return ujson.loads(text_data)
+    if fmt == 'msgpack':
+        return msgpack.unpackb(bytes_data, raw=False)
+    if fmt == 'cbor':
+        return cbor2.loads(bytes_data)
+    return ujson.loads(bytes_data)
@@ -3,4 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<character_id>\w+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/room/(?P<room_id>[\w-]+)/$', consumers.RoomConsumer.as_asgi()),
 ]
@@ -1,3 +1,4 @@
+import json
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
@@ -5,69 +6,55 @@ from rest_framework import status
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import make_password
-import jwt
-import stripe
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse
-from datetime import datetime, timedelta, timezone
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
+from asgiref.sync import sync_to_async
+from datetime import datetime, timezone
 from functools import wraps
-from .models import Conversation, Subscription
+from . import connections, erasure, generations, model_router
+from .archive import last_message
+from .auth import generate_token, get_user_from_token, user_id_from_token
+from .payments import create_customer_async, get_stripe, get_stripe_client, precreate_customer
+from .models import Conversation, ErasureJob, Subscription
 
 
-def get_user_from_token(request):
-    """Extract user from JWT token in Authorization header."""
-    auth_header = request.headers.get('Authorization', '')
-    if not auth_header.startswith('Bearer '):
-        return None
-
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-        user = User.objects.get(id=payload['user_id'])
-        return user
-    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError, User.DoesNotExist):
-        return None
-
-
-def generate_token(user):
-    """Generate JWT token for user."""
-    payload = {
-        'user_id': user.id,
-        'email': user.email,
-        'exp': datetime.utcnow() + timedelta(days=7),
-        'iat': datetime.utcnow()
-    }
-    return jwt.encode(payload, settings.SECRET_KEY, algorithm='HS256')
-
-
-@api_view(['POST'])
-@permission_classes([AllowAny])
-def register(request):
+@csrf_exempt
+@require_POST
+async def register(request):
     """Register a new user."""
-    data = request.data
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid request body'}, status=status.HTTP_400_BAD_REQUEST)
     username = data.get('username', '').strip()
     email = data.get('email', '').strip().lower()
     password = data.get('password', '')
 
     if not username or not email or not password:
-        return Response({'error': 'All fields are required'}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse({'error': 'All fields are required'}, status=status.HTTP_400_BAD_REQUEST)
 
-    if User.objects.filter(email=email).exists():
-        return Response({'error': 'Email already registered'}, status=status.HTTP_400_BAD_REQUEST)
+    if await User.objects.filter(email=email).aexists():
+        return JsonResponse({'error': 'Email already registered'}, status=status.HTTP_400_BAD_REQUEST)
 
-    if User.objects.filter(username=username).exists():
-        return Response({'error': 'Username already taken'}, status=status.HTTP_400_BAD_REQUEST)
+    if await User.objects.filter(username=username).aexists():
+        return JsonResponse({'error': 'Username already taken'}, status=status.HTTP_400_BAD_REQUEST)
 
-    user = User.objects.create(
+    user = await User.objects.acreate(
         username=username,
         email=email,
         password=make_password(password)
     )
 
+    # Create the Stripe customer after responding, so checkout is a single
+    # Stripe call and signup never waits on Stripe
+    if settings.STRIPE_SECRET_KEY:
+        generations.spawn(precreate_customer(user))
+
     token = generate_token(user)
 
-    return Response({
+    return JsonResponse({
         'message': 'Registration successful',
         'token': token,
         'user': {
@@ -180,16 +167,53 @@ def update_profile(request):
     })
 
 
-@api_view(['DELETE'])
-def delete_account(request):
-    """Delete user's account."""
-    user = get_user_from_token(request)
+@csrf_exempt
+@require_http_methods(['DELETE'])
+async def delete_account(request):
+    """Delete user's account and conversations.
+
+    Erasure runs as a background job (see chat/erasure.py); this returns
+    straight away with the job ID, which erasure_status reports on.
+    """
+    user = await sync_to_async(get_user_from_token)(request)
     if not user:
-        return Response({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+        return JsonResponse({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
 
-    user.delete()
+    job = await sync_to_async(erasure.create_job)(user)
+    if job.status != 'done':
+        erasure.start(job)
 
-    return Response({'message': 'Account deleted successfully'})
+    return JsonResponse({
+        'message': 'Account deletion started',
+        'jobId': str(job.id),
+        'status': job.status,
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+@require_GET
+async def erasure_status(request, job_id):
+    """Progress of an account erasure job, for the user being erased.
+
+    The user row is gone once the job finishes, so the token is only
+    checked for its signature and user ID.
+    """
+    auth_header = request.headers.get('Authorization', '')
+    user_id = user_id_from_token(auth_header[7:]) if auth_header.startswith('Bearer ') else None
+    if user_id is None:
+        return JsonResponse({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    job = await ErasureJob.objects.filter(pk=job_id, user_id=user_id).afirst()
+    if not job:
+        return JsonResponse({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    return JsonResponse({
+        'jobId': str(job.id),
+        'status': job.status,
+        'progress': round(job.progress, 3),
+        'conversations': {'deleted': job.conversations_deleted, 'total': job.conversations_total},
+        'messages': {'deleted': job.messages_deleted, 'total': job.messages_total},
+        'finishedAt': job.finished_at.isoformat() if job.finished_at else None,
+    })
 
 
 @api_view(['GET'])
@@ -207,79 +231,104 @@ def recent_chats(request):
     chats = []
     for conv in conversations:
         # Get the last message
-        last_message = conv.messages.last()
+        last = last_message(conv)
         last_message_preview = ''
-        if last_message:
-            last_message_preview = last_message.content[:40] + '...' if len(last_message.content) > 40 else last_message.content
+        if last:
+            last_message_preview = last['content'][:40] + '...' if len(last['content']) > 40 else last['content']
 
         chats.append({
             'id': conv.character_id,
             'name': conv.character_name,
             'avatar': conv.character_avatar,
             'lastMessage': last_message_preview or 'Start a conversation...',
-            'time': conv.updated_at.strftime('%H:%M') if last_message else '',
+            'time': conv.updated_at.strftime('%H:%M') if last else '',
         })
 
     return Response({'chats': chats})
 
 
-@api_view(['POST'])
-@permission_classes([AllowAny])
-def create_checkout_session(request):
+@require_GET
+async def connection_report(request):
+    """Open sockets in this process and the memory they hold (staff only).
+
+    Async so it reads the consumer registry on the event loop that owns it.
+    """
+    user = await sync_to_async(get_user_from_token)(request)
+    if not user:
+        return JsonResponse({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+    if not user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
+
+    return JsonResponse(connections.report())
+
+
+@require_GET
+async def route_report(request):
+    """Latency and cost per model route in this process (staff only)."""
+    user = await sync_to_async(get_user_from_token)(request)
+    if not user:
+        return JsonResponse({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+    if not user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
+
+    return JsonResponse(model_router.report())
+
+
+@csrf_exempt
+@require_POST
+async def create_checkout_session(request):
     """Create a Stripe Checkout Session for subscription."""
-    user = get_user_from_token(request)
+    user = await sync_to_async(get_user_from_token)(request)
     if not user:
-        return Response({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+        return JsonResponse({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
 
-    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe = get_stripe()
 
     try:
-        subscription = Subscription.objects.filter(user=user).first()
+        subscription = await Subscription.objects.filter(user=user).afirst()
+
+        if subscription and subscription.is_active:
+            return JsonResponse({'error': 'Already subscribed'}, status=status.HTTP_400_BAD_REQUEST)
 
+        # Customers are normally created just after registration; this covers
+        # older accounts, and signups where that hasn't finished or failed
         if subscription and subscription.stripe_customer_id:
             customer_id = subscription.stripe_customer_id
         else:
-            customer = stripe.Customer.create(
-                email=user.email,
-                metadata={'user_id': user.id}
-            )
-            customer_id = customer.id
+            customer_id = await create_customer_async(user)
 
             if not subscription:
-                subscription = Subscription.objects.create(
+                subscription = await Subscription.objects.acreate(
                     user=user,
                     stripe_customer_id=customer_id,
                 )
             else:
                 subscription.stripe_customer_id = customer_id
-                subscription.save()
-
-        if subscription.is_active:
-            return Response({'error': 'Already subscribed'}, status=status.HTTP_400_BAD_REQUEST)
+                await subscription.asave()
 
-        checkout_session = stripe.checkout.Session.create(
-            customer=customer_id,
-            payment_method_types=['card'],
-            line_items=[{
+        checkout_session = await get_stripe_client().checkout.sessions.create_async(params={
+            'customer': customer_id,
+            'payment_method_types': ['card'],
+            'line_items': [{
                 'price': settings.STRIPE_PRICE_ID,
                 'quantity': 1,
             }],
-            mode='subscription',
-            success_url=request.build_absolute_uri('/profile?tab=subscription&status=success'),
-            cancel_url=request.build_absolute_uri('/profile?tab=subscription&status=canceled'),
-            metadata={'user_id': user.id},
-        )
+            'mode': 'subscription',
+            'success_url': request.build_absolute_uri('/profile?tab=subscription&status=success'),
+            'cancel_url': request.build_absolute_uri('/profile?tab=subscription&status=canceled'),
+            'metadata': {'user_id': user.id},
+        })
 
-        return Response({'checkout_url': checkout_session.url})
+        return JsonResponse({'checkout_url': checkout_session.url})
 
     except stripe.error.StripeError as e:
-        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 @csrf_exempt
 def stripe_webhook(request):
     """Handle Stripe webhook events."""
-    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe = get_stripe()
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE', '')
 
@@ -362,29 +411,29 @@ def subscription_status(request):
         })
 
 
-@api_view(['POST'])
-@permission_classes([AllowAny])
-def cancel_subscription(request):
+@csrf_exempt
+@require_POST
+async def cancel_subscription(request):
     """Cancel the user's subscription at period end."""
-    user = get_user_from_token(request)
+    user = await sync_to_async(get_user_from_token)(request)
     if not user:
-        return Response({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+        return JsonResponse({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
 
-    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe = get_stripe()
 
     try:
-        sub = Subscription.objects.get(user=user)
+        sub = await Subscription.objects.aget(user=user)
         if not sub.stripe_subscription_id:
-            return Response({'error': 'No active subscription'}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({'error': 'No active subscription'}, status=status.HTTP_400_BAD_REQUEST)
 
-        stripe.Subscription.modify(
+        await get_stripe_client().subscriptions.update_async(
             sub.stripe_subscription_id,
-            cancel_at_period_end=True,
+            params={'cancel_at_period_end': True},
         )
 
-        return Response({'message': 'Subscription will cancel at end of billing period'})
+        return JsonResponse({'message': 'Subscription will cancel at end of billing period'})
 
     except Subscription.DoesNotExist:
-        return Response({'error': 'No subscription found'}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse({'error': 'No subscription found'}, status=status.HTTP_404_NOT_FOUND)
     except stripe.error.StripeError as e:
-        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
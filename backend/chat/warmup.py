@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.urls import get_resolver
+from . import generations, payments, pipeline
+
+
+def warm_up():
+    """Load everything the first requests would otherwise pay for.
+
+    Called from the lifespan startup handler, so importing the ASGI module
+    stays fast and the server only accepts connections once this is done.
+    """
+    # URLconf, and with it chat.views
+    get_resolver().url_patterns
+
+    # Shared API clients (imports openai and stripe)
+    generations.get_client()
+    if settings.STRIPE_SECRET_KEY:
+        payments.get_stripe_client()
+
+    # Moderation automata
+    pipeline.get_stages()
+
+    # Compiled frontend shell served by the catch-all route
+    try:
+        get_template('index.html')
+    except TemplateDoesNotExist:
+        pass
+
+    print(f"Worker warmed up (DEBUG={settings.DEBUG})")
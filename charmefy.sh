@@ -20,6 +20,8 @@ usage() {
     echo "  deploy      Full deploy: git pull + pip install + npm build + collectstatic + migrate + restart"
     echo "  build       Build frontend + collectstatic only"
     echo "  migrate     Run Django migrations only"
+    echo "  archive     Archive messages older than MESSAGE_RETENTION_DAYS"
+    echo "  erase       Finish interrupted account erasure jobs"
 }
 
 cmd_status() {
@@ -69,6 +71,20 @@ cmd_migrate() {
     echo "==> Migrations complete."
 }
 
+cmd_archive() {
+    echo "==> Archiving old messages..."
+    cd "$BACKEND_DIR"
+    "$VENV/python" manage.py archive_messages
+    echo "==> Archive complete."
+}
+
+cmd_erase() {
+    echo "==> Resuming account erasures..."
+    cd "$BACKEND_DIR"
+    "$VENV/python" manage.py erase_accounts
+    echo "==> Erasure complete."
+}
+
 cmd_deploy() {
     echo "==> Starting deploy..."
 
@@ -120,6 +136,8 @@ case "$1" in
     deploy)    cmd_deploy ;;
     build)     cmd_build ;;
     migrate)   cmd_migrate ;;
+    archive)   cmd_archive ;;
+    erase)     cmd_erase ;;
     *)
         echo "Unknown command: $1"
         usage
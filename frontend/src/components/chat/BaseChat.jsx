@@ -25,6 +25,8 @@ const BaseChat = ({
   recentChats = [],
   onSendMessage,
   onGenerateImage,
+  onLoadOlder,
+  hasOlder = false,
   isTyping = false,
   isLoggedIn = false
 }) => {
@@ -144,6 +146,11 @@ const BaseChat = ({
         </div>
 
         <div className="chat-messages">
+          {hasOlder && onLoadOlder && (
+            <button className="load-older-btn" onClick={onLoadOlder}>
+              Load earlier messages
+            </button>
+          )}
           {messages.map((msg) => (
             <div key={msg.id} className={`message ${msg.sender}`}>
               {msg.sender === 'character' && (
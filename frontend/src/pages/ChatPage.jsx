@@ -92,8 +92,11 @@ const ChatPage = () => {
   const [recentChats, setRecentChats] = useState([]);
   const [isConnected, setIsConnected] = useState(false);
   const [isTyping, setIsTyping] = useState(false);
+  const [hasOlder, setHasOlder] = useState(false);
   const wsRef = useRef(null);
   const messageIdRef = useRef(1);
+  const lastSeqRef = useRef(0); // Newest message seq received, for resuming after a reconnect
+  const oldestSeqRef = useRef(0); // Oldest message seq shown, for loading earlier ones
   const characterRef = useRef(character);
   const loggedIn = isLoggedIn();
   const sessionId = loggedIn ? getSessionId() : null;
@@ -139,6 +142,9 @@ const ChatPage = () => {
     // Reset messages when character changes
     setMessages([]);
     messageIdRef.current = 1;
+    lastSeqRef.current = 0;
+    oldestSeqRef.current = 0;
+    setHasOlder(false);
 
     // Don't connect WebSocket if not logged in
     if (!loggedIn) {
@@ -154,77 +160,151 @@ const ChatPage = () => {
     const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
     const wsUrl = `${wsProtocol}//${window.location.host}/ws/chat/${character.id}/`;
 
-    const ws = new WebSocket(wsUrl);
-    wsRef.current = ws;
-
-    ws.onopen = () => {
-      console.log('WebSocket connected');
-      setIsConnected(true);
-
-      // Send character info and session ID to backend
-      const currentChar = characterRef.current;
-      ws.send(JSON.stringify({
-        type: 'init',
-        sessionId: sessionId,
-        character: {
-          id: currentChar.id,
-          name: currentChar.name,
-          avatar: currentChar.avatar,
-          systemPrompt: currentChar.systemPrompt,
-        }
-      }));
+    let closing = false; // Set when we close the socket ourselves
+    let attempts = 0;
+    let retryAfterMs = null; // Delay asked for by the server, if any
+    let retryTimer = null;
+    let heartbeat = null;
+
+    const seen = (seq) => {
+      if (seq) {
+        lastSeqRef.current = Math.max(lastSeqRef.current, seq);
+      }
     };
 
-    ws.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+    const toMessage = (msg) => ({
+      id: messageIdRef.current++,
+      sender: msg.sender,
+      content: msg.content,
+    });
 
-      if (data.type === 'session') {
-        // Store session ID if provided by server
-        if (data.session_id) {
-          localStorage.setItem('session_id', data.session_id);
-        }
-      } else if (data.type === 'history') {
-        // Load message history
-        const historyMessages = data.messages.map((msg) => ({
-          id: messageIdRef.current++,
-          sender: msg.sender,
-          content: msg.content,
+    const connect = () => {
+      const ws = new WebSocket(wsUrl);
+      wsRef.current = ws;
+
+      ws.onopen = () => {
+        console.log('WebSocket connected');
+        setIsConnected(true);
+        attempts = 0;
+
+        // Heartbeat so the server doesn't close the socket as dead
+        heartbeat = setInterval(() => {
+          if (ws.readyState === WebSocket.OPEN) {
+            ws.send(JSON.stringify({ type: 'ping' }));
+          }
+        }, 30000);
+
+        // Send character info and session ID to backend; after a reconnect,
+        // only ask for messages we haven't seen
+        const currentChar = characterRef.current;
+        ws.send(JSON.stringify({
+          type: 'init',
+          sessionId: sessionId,
+          lastSeq: lastSeqRef.current || undefined,
+          token: localStorage.getItem('token'),
+          character: {
+            id: currentChar.id,
+            name: currentChar.name,
+            avatar: currentChar.avatar,
+            systemPrompt: currentChar.systemPrompt,
+          }
         }));
-        setMessages(historyMessages);
-      } else if (data.type === 'message') {
-        setIsTyping(false);
-        const newMessage = {
-          id: messageIdRef.current++,
-          sender: 'character',
-          content: data.content,
-        };
-        setMessages(prev => [...prev, newMessage]);
-        // Refresh recent chats after receiving a message (use ref to avoid dependency)
-        if (fetchRecentChatsRef.current) {
-          fetchRecentChatsRef.current();
+      };
+
+      ws.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+
+        if (data.type === 'session') {
+          // Store session ID if provided by server
+          if (data.session_id) {
+            localStorage.setItem('session_id', data.session_id);
+          }
+        } else if (data.type === 'history') {
+          // Load message history (or just what we missed, on reconnect)
+          data.messages.forEach((msg) => seen(msg.seq));
+          const historyMessages = data.messages.map(toMessage);
+          if (data.since) {
+            setMessages(prev => [...prev, ...historyMessages]);
+            setIsTyping(false);
+          } else {
+            // Only the most recent messages; earlier ones are loaded on request
+            oldestSeqRef.current = data.messages[0].seq;
+            setHasOlder(data.more);
+            setMessages(historyMessages);
+          }
+        } else if (data.type === 'older') {
+          if (data.messages.length) {
+            oldestSeqRef.current = data.messages[0].seq;
+            setMessages(prev => [...data.messages.map(toMessage), ...prev]);
+          }
+          setHasOlder(data.more);
+        } else if (data.type === 'message') {
+          seen(data.seq);
+          setIsTyping(false);
+          const newMessage = {
+            id: messageIdRef.current++,
+            sender: 'character',
+            content: data.content,
+          };
+          setMessages(prev => [...prev, newMessage]);
+          // Refresh recent chats after receiving a message (use ref to avoid dependency)
+          if (fetchRecentChatsRef.current) {
+            fetchRecentChatsRef.current();
+          }
+        } else if (data.type === 'user_message') {
+          // Sent from another tab on the same conversation
+          seen(data.seq);
+          const newMessage = {
+            id: messageIdRef.current++,
+            sender: 'user',
+            content: data.content,
+          };
+          setMessages(prev => [...prev, newMessage]);
+        } else if (data.type === 'ack') {
+          seen(data.seq);
+        } else if (data.type === 'typing') {
+          setIsTyping(true);
+        } else if (data.type === 'reconnect') {
+          // Server is restarting and says when to come back
+          retryAfterMs = data.retryAfterMs;
+        } else if (data.type === 'error') {
+          console.error('WebSocket error:', data.message);
+          setIsTyping(false);
         }
-      } else if (data.type === 'typing') {
-        setIsTyping(true);
-      } else if (data.type === 'error') {
-        console.error('WebSocket error:', data.message);
-        setIsTyping(false);
-      }
-    };
+      };
 
-    ws.onclose = () => {
-      console.log('WebSocket disconnected');
-      setIsConnected(false);
-    };
+      ws.onclose = () => {
+        console.log('WebSocket disconnected');
+        setIsConnected(false);
+        clearInterval(heartbeat);
+        if (closing) {
+          return;
+        }
+
+        // Reconnect with jittered exponential backoff, so a restart doesn't
+        // bring every client back at the same moment
+        const backoff = Math.min(30000, 1000 * 2 ** attempts);
+        const delay = retryAfterMs ?? backoff / 2 + Math.random() * backoff / 2;
+        retryAfterMs = null;
+        attempts += 1;
+        retryTimer = setTimeout(connect, delay);
+      };
 
-    ws.onerror = (error) => {
-      console.error('WebSocket error:', error);
-      setIsConnected(false);
+      ws.onerror = (error) => {
+        console.error('WebSocket error:', error);
+        setIsConnected(false);
+      };
     };
 
+    connect();
+
     // Cleanup on unmount or character change
     return () => {
-      if (ws.readyState === WebSocket.OPEN) {
-        ws.close();
+      closing = true;
+      clearTimeout(retryTimer);
+      clearInterval(heartbeat);
+      if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+        wsRef.current.close();
       }
     };
     // eslint-disable-next-line react-hooks/exhaustive-deps
@@ -256,6 +336,15 @@ const ChatPage = () => {
     }
   };
 
+  const handleLoadOlder = () => {
+    if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN && oldestSeqRef.current) {
+      wsRef.current.send(JSON.stringify({
+        type: 'older',
+        beforeSeq: oldestSeqRef.current,
+      }));
+    }
+  };
+
   const handleGenerateImage = () => {
     console.log('Generate image clicked');
     // TODO: Implement image generation
@@ -268,6 +357,8 @@ const ChatPage = () => {
       recentChats={recentChats}
       onSendMessage={handleSendMessage}
       onGenerateImage={handleGenerateImage}
+      onLoadOlder={handleLoadOlder}
+      hasOlder={hasOlder}
       isTyping={isTyping}
       isLoggedIn={loggedIn}
     />